@@ -1,53 +1,227 @@
-from flask import Flask, render_template, request
-import subprocess
+from flask import Flask, Response, jsonify, redirect, render_template, request, send_file, stream_with_context, url_for
+import asyncio
+import contextvars
+import json
+import multiprocessing
 import os
-import pandas as pd
-from finresult import printresponse
+import re
+import shutil
+import sys
+import threading
+import uuid
+from loguru import logger as log
+
+# run.py and ebay.py live one level up from the Flask app
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import ebay
+import finresult
+import items
+import metrics
+import store
+from ebay import iter_search
+from jobs import JobQueueFull, JobRunner
+from run import build_search_url, run as run_scrape
+
 app = Flask(__name__)
 
+# Parse pages in this many worker processes instead of on the job loop, 0 keeps parsing in process
+PARSE_PROCESSES = int(os.environ.get('EBAYFINDER_PARSE_PROCESSES', 0))
+
+# Created on first use rather than at import, spawned parse workers import this module too
+_jobs = None
+_parse_pool = None
+_startup_lock = threading.Lock()
+
+def get_jobs():
+    """One worker pool for the whole process, scrapes no longer spawn a new interpreter."""
+    global _jobs
+    with _startup_lock:
+        if _jobs is None:
+            _jobs = JobRunner(
+                max_concurrent=int(os.environ.get('EBAYFINDER_MAX_JOBS', 2)),
+                max_queued=int(os.environ.get('EBAYFINDER_MAX_QUEUED', 20)),
+                on_evict=remove_results,
+            )
+            remove_orphaned_results()
+    return _jobs
+
+def get_parse_pool():
+    """The shared parse process pool, None when EBAYFINDER_PARSE_PROCESSES is 0."""
+    global _parse_pool
+    with _startup_lock:
+        if _parse_pool is None and PARSE_PROCESSES:
+            _parse_pool = ebay.parse_pool(PARSE_PROCESSES)
+    return _parse_pool
+
+def warm_start():
+    """Import the heavy dependencies and create the shared clients before the first search needs them."""
+    import pandas
+    import pyarrow.feather
+    import prerank
+
+    get_jobs()
+    get_parse_pool()
+    finresult.get_backend()
+    ebay._client()
+    items.get_index()
+
+# In the background, so the server accepts requests right away and new workers start fast.
+# Not in spawned parse workers, which re-import the main script as __mp_main__.
+if multiprocessing.parent_process() is None and os.environ.get('EBAYFINDER_WARM_START', '1') != '0':
+    threading.Thread(target=warm_start, name='warm-start', daemon=True).start()
+
 @app.route('/',  methods=['GET', 'POST'])
 def index():
     return render_template('index.html')
 
+def results_dir(job_id):
+    return store.RESULTS_DIR / job_id
+
+def remove_results(job):
+    """Delete a forgotten job's tables and export, its items stay in the item index."""
+    shutil.rmtree(results_dir(job.id), ignore_errors=True)
+
+def remove_orphaned_results():
+    """Delete the result directories of jobs from earlier runs, jobs only live as long as the process."""
+    if store.RESULTS_DIR.exists():
+        for path in store.RESULTS_DIR.iterdir():
+            if path.is_dir() and re.fullmatch('[0-9a-f]{32}', path.name):
+                shutil.rmtree(path, ignore_errors=True)
+
+async def scrape_and_rank(job_id, product, min_price):
+    """Scrape the product, ask the model for the best deals and return the chosen item ids."""
+    # every job gets its own result tables so concurrent searches don't overwrite each other
+    job_dir = await run_scrape(product, min_price, results_dir(job_id), pool=get_parse_pool())
+    loop = asyncio.get_running_loop()
+    # run_in_executor doesn't carry context variables over, the job's trace has to follow the ranking
+    context = contextvars.copy_context()
+    ranking = await loop.run_in_executor(None, context.run, finresult.rank, job_dir, product)
+    log.info(f"ranked {product!r}: {ranking.to_dict()}")
+    indices = ranking.indices
+
+    return [row["id"] for row in store.take(job_dir, "search", indices)]
+
+def ranked_items(job):
+    """The job's chosen items, read from the item index."""
+    return items.get_index().get_many(job.result)
+
+def submit_job(product, min_price):
+    job_id = uuid.uuid4().hex
+    return get_jobs().submit(f"{product} (min {min_price})", scrape_and_rank, job_id, product, min_price, job_id=job_id)
+
 @app.route('/process_form', methods=['POST'])
 def process_form():
     product = request.form['product']
-    min_price = request.form['min_price']   
-    parent_dir = os.path.dirname(os.path.abspath(__file__))  # Get the parent directory of caller.py
-    other_program_path = os.path.join(parent_dir, "..", "run.py")  # Go up one level and then down to other_program.py
-    subprocess.run(["python", other_program_path, product, min_price])
-    Str = printresponse()
-    print(Str)
-    N = 30
-    
-    # print the string
-    
-    # get length of string
-    length = len(Str)
-    
-    # create a new string of last N characters
-    Str2 = Str[length - N:]
-    
-    # print Last N characters
-    print(Str2)
-    indices = list(map(int, Str2.split(', ')))
-
-    data = search_data_by_indices(load_excel_file(), indices)
-    return render_template('results.html', data=data)
+    min_price = request.form['min_price']
+    try:
+        job = submit_job(product, min_price)
+    except JobQueueFull:
+        return 'Too many searches are running, please try again in a moment.', 503
+    return redirect(url_for('job_results', job_id=job.id))
+
+@app.route('/jobs', methods=['POST'])
+def create_job():
+    params = request.get_json(silent=True) or request.form
+    try:
+        job = submit_job(params['product'], params['min_price'])
+    except JobQueueFull as e:
+        return jsonify(error=str(e)), 503
+    return jsonify(job.to_dict()), 202
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    job = get_jobs().get(job_id)
+    if job is None:
+        return jsonify(error='unknown job'), 404
+    status = job.to_dict()
+    if job.status == 'done':
+        status['results'] = ranked_items(job)
+    if request.args.get('trace'):
+        status['trace'] = job.trace
+    return jsonify(status)
+
+@app.route('/results/<job_id>')
+def job_results(job_id):
+    job = get_jobs().get(job_id)
+    if job is None:
+        return 'Unknown search', 404
+    if not job.done:
+        return render_template('results.html', data=[], job=job)
+    if job.status == 'failed':
+        return f'Search failed: {job.error}', 500
+    return render_template('results.html', data=ranked_items(job), job=job)
+
+@app.route('/results/<job_id>/export')
+def export_results(job_id):
+    """Excel export of a finished search, only built when somebody asks for it."""
+    job = get_jobs().get(job_id)
+    if job is None or job.status != 'done':
+        return 'Unknown search', 404
+    excel_path = results_dir(job_id) / 'ebay_data.xlsx'
+    if not excel_path.exists():
+        store.export_excel(results_dir(job_id), excel_path)
+    return send_file(excel_path, as_attachment=True, download_name='ebay_data.xlsx')
+
+@app.route('/stream')
+def stream_search():
+    """Stream listings as server-sent events while the search pages come in."""
+    product = request.args['product']
+    min_price = request.args.get('min_price', 1)
+    max_pages = int(request.args.get('max_pages', 2))
+    # a stream counts against the same concurrency limit as queued searches
+    try:
+        get_jobs().reserve()
+    except JobQueueFull:
+        return 'Too many searches are running, please try again in a moment.', 503
+
+    def events():
+        pages = iter_search(
+            build_search_url(product, min_price), min_price, max_pages=max_pages, start_index=0, pool=get_parse_pool()
+        )
+        for listings in get_jobs().iterate(pages):
+            for listing in listings:
+                yield f"data: {json.dumps(listing.to_dict())}\n\n"
+        yield "event: done\ndata: {}\n\n"
+
+    response = Response(stream_with_context(events()), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    # closed after the last event or when the client goes away, even if the stream never started
+    response.call_on_close(get_jobs().release)
+    return response
+
+@app.route('/cache')
+def cache_stats():
+    ranking = {'hits': finresult.RESPONSES.hits, 'misses': finresult.RESPONSES.misses}
+    if ebay.CACHE is None:
+        return jsonify(enabled=False, ranking=ranking)
+    return jsonify(enabled=True, ranking=ranking, **ebay.CACHE.stats())
+
+@app.route('/items')
+def query_items():
+    """Items from every search so far, cheapest first, filtered by min_price, max_price and condition."""
+    found = items.get_index().query(
+        min_price=request.args.get('min_price', type=int),
+        max_price=request.args.get('max_price', type=int),
+        condition=request.args.get('condition'),
+        limit=request.args.get('limit', 100, type=int),
+    )
+    return jsonify(found)
+
+@app.route('/items/<item_id>')
+def get_item(item_id):
+    item = items.get_index().get(item_id)
+    if item is None:
+        return jsonify(error='unknown item'), 404
+    return jsonify(item)
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Fetch, parse, store and model timings in the Prometheus text format."""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/readme', methods=['POST', 'GET'])
 def readme():
-    
-    return render_template('readme.html')
-def load_excel_file():
-    # Update the path to your Excel file
-    file_path = os.path.join(os.path.dirname(__file__), '../', 'results', 'ebay_data.xlsx')
-    df = pd.read_excel(file_path)
-    return df
-
-def search_data_by_indices(df, indices):
-    filtered_df = df.iloc[indices]
-    filtered_df.reset_index(inplace=True)
-    return filtered_df.to_dict(orient='records')
 
+    return render_template('readme.html')
 if __name__ == '__main__':
     app.run(debug=True)
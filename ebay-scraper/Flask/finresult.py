@@ -1,22 +1,47 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
 from pathlib import Path
-import pandas as pd
-import google.generativeai as genai
+from typing import TYPE_CHECKING, Optional
+from loguru import logger as log
+
+import metrics
+import store
+
+# pandas (through prerank) and google.generativeai are imported on first use, they take
+# most of a second to import and the web app shouldn't wait on them to start
+if TYPE_CHECKING:
+    import pandas as pd
 
 # Install the package if not already installed
 # pip install google-generativeai
-def printresponse():
-    # Configure the API key
-    genai.configure(api_key="")
-
-    # Set up the model configuration
-    generation_config = {
-        "temperature": 1,
-        "top_p": 0.95,
-        "top_k": 64,
-        "max_output_tokens": 8192,
-    }
-
-    system_instruction = """
+
+# The reply the model has to give, enforced through Gemini's JSON mode
+RANKING_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "best_deal": {"type": "INTEGER"},
+        "recommendations": {"type": "ARRAY", "items": {"type": "INTEGER"}},
+        "summary": {"type": "STRING"},
+    },
+    "required": ["best_deal", "recommendations"],
+}
+
+# Set up the model configuration
+GENERATION_CONFIG = {
+    "temperature": 1,
+    "top_p": 0.95,
+    "top_k": 64,
+    "max_output_tokens": 8192,
+    "response_mime_type": "application/json",
+    "response_schema": RANKING_SCHEMA,
+}
+
+SYSTEM_INSTRUCTION = """
     You will be given a list of products. You will remove all outliers in the list like accessories to the product.
     You will then return by index the product with the maximum Price,
     the one with the lowest price, and what is the best deal for your money.
@@ -26,42 +51,256 @@ def printresponse():
     If the specific model is given, make sure to filter out all the other models even if they are very similar.
     You will be told what the actual product is so you can remove any outliers.
     Finally, you will return 5 other recommended products by index
-    Your final line of text will return first the index of the best deal product, then the indexes of the 5 other recommended products in the following format:
-    034 067 012 044 078 101
+    Reply with JSON only: "best_deal" is the index of the best deal product, "recommendations" the indexes of the 5 other recommended products
+    and "summary" a short explanation, for example:
+    {"best_deal": 34, "recommendations": [67, 12, 44, 78, 101], "summary": "..."}
     """
 
-    # Initialize the model
-    model = genai.GenerativeModel(model_name="gemini-1.5-flash",
-                                generation_config=generation_config,
-                                system_instruction=system_instruction)
-
-    # Function to extract content from an Excel file and convert to a list of strings
-    def extract_excel_data(file_path: str) -> list[str]:
-        df = pd.read_excel(file_path)
-        data_str_list = df.astype(str).values.flatten().tolist()
-        return data_str_list
+# How many other products the model recommends next to the best deal
+RECOMMENDATIONS = 5
 
-    # Define the file path to your Excel file
-    excel_file_path = r'C:\Users\meesh\Downloads\EbayScrap\Ebay Scraper\scrapfly-scrapers\ebay-scraper\results\ebay_data.xlsx'
+# Worked examples sent ahead of the scraped listings, each answered in the RANKING_SCHEMA format
+def _example(product: str, best_deal: int, recommendations: list[int], summary: str) -> list[str]:
+    answer = {"best_deal": best_deal, "recommendations": recommendations, "summary": summary}
+    return [f"{product}\n\n", json.dumps(answer)]
 
-    # Create the prompt parts with data from the Excel file
-
-    prompt_parts = [
-    "Meta Quest 3\n\n",
+EXAMPLE_PARTS = [
     #*extract_pdf_pages("<path>/document0.pdf"),
-    "\n## Meta Quest 3 Analysis:\n\n**Highest Price:**\n\n* **Index 69:** Used Meta Quest 3 128GB VR Headset w/ Elite Strap And Carrying Case for **$524.99**.  This is likely overpriced due to the inclusion of accessories.\n\n**Lowest Price:**\n\n* **Index 1:** New Listing Meta Quest 3 for **$400.00** in Pre-Owned condition.  While this is the lowest price, the condition and lack of details in the listing may be concerning.\n\n**Best Deal:**\n\n*  Index 1: This is the best priced one and is in Pre-Owned Condition.\n001, 045, 078, 098, 102, 033\n\nApple pro 6th generation\n",
+    *_example(
+        "Meta Quest 3", 1, [45, 78, 98, 102, 33],
+        "Index 1 is the cheapest Meta Quest 3 at $400.00 in Pre-Owned condition. Index 69 at $524.99 is overpriced "
+        "because of the Elite Strap and carrying case bundled with it.",
+    ),
     #*extract_pdf_pages("<path>/document1.pdf"),
-    "\n## Apple iPad Pro 6th Generation Analysis: \n\nBased on the provided eBay data, I have filtered listings for other iPad models, iPads with accessories bundled in, and \"For Parts\" items. Here's a summary:\n\n**Highest Price:**\n\n* **Index 101:** New Apple 12.9\" iPad Pro 6th Gen M2 2TB Wi-Fi + 5G Cellular Unlocked Space Gray for **$1,699.99**. This is a brand new, high-end configuration with maximum storage and cellular connectivity, explaining the top price.\n\n**Lowest Price:**\n\n* **Index 29:** Apple iPad 6th Gen 32GB - Wi-Fi Only -  Very Good for **$117.00**. This is a regular iPad 6th gen, not the Pro model, with lower storage capacity and in refurbished condition.\n\n**Best Deal:**\n\n*  **Index 31:** Apple iPad Pro 6th Gen. 256GB, Wi-Fi, 12.9in - Space Gray. **$700.00**. This is the one of the best priced Ipad Pro but has 256 Gb instead of the slightly lower priced 128Gb model available at index 33\n\nMake sure to only list iPad Pro's and not any other model. You should not have included the the regular ipad\n\n\n031, 005, 028, 068, 012, 038\n\n\niPhone 11 Pro Max Unlocked\n\n",
+    *_example(
+        "Apple pro 6th generation", 31, [5, 28, 68, 12, 38],
+        "Only iPad Pro 6th generation listings count, regular iPads, bundles and for parts items are left out. "
+        "Index 31, a 256GB Wi-Fi 12.9in iPad Pro for $700.00, is one of the best priced and has twice the storage "
+        "of the slightly cheaper 128GB model at index 33.",
+    ),
     #*extract_pdf_pages("<path>/document2.pdf"),
-    "\n\n\n## iPhone 11 Pro Max Unlocked Analysis: \n\nI've filtered out listings that weren't for the iPhone 11 Pro Max, locked phones, those bundled with accessories, and \"For Parts\" items. \n\n**Highest Price:**\n\n* **Index 55:** Apple iPhone 11 PRO MAX 64GB 256GB 512GB (UNLOCKED) ⚫🟠🔋 100% BATTERY🔋❖SEALED❖ for **$444.95**.  This is a brand new, sealed unit, justifying the higher cost.\n\n**Lowest Price:**\n\n* **Index 59:** 【Lowest Price Online】Apple iPhone 11 Pro Max 64G/256G- 6.5-inch screen-Unlocked for **$79.70** from China. The extremely low price and origin raise concerns about authenticity and condition.\n\n**Best Deal:**\n\n* **Index 25:** Apple iPhone 11 Pro Max - A2161 - 256GB - Space Gray (None - Unlocked)  (s17248) for **$264.11**. This offers a good balance of storage space (256GB) and price, assuming the condition is acceptable based on the seller's description.\n",
+    *_example(
+        "iPhone 11 Pro Max Unlocked", 25, [44, 78, 13, 90, 47],
+        "Locked phones, other models, bundles and for parts items are left out. Index 25, a 256GB iPhone 11 Pro Max "
+        "for $264.11, balances storage and price. Index 59 at $79.70 is too cheap to be genuine.",
+    ),
     #*extract_pdf_pages("<path>/document3.pdf"),
-    "\n#\n025, 044, 078, 013, 090, 047\n## Ember Mug 2 Analysis:\n\nI've filtered the listings to only include Ember Mug 2 models, excluding those with accessories, \"For Parts\" items, and listings for other Ember products (like the travel mug).\n\n**Highest Price:**\n\n* **Index 23:** Ember Mug2 Smart Temperature Controlled Cup 14OZ IPX7 LED Stainless Steel Copper for **$134**. This is a brand new, stainless steel mug with extra features, justifying its high price.\n\n**Lowest Price:**\n\n* **Index 2:** Ember Temperature Control Smart Mug 2 10 oz. Smartphone Control 1.5 Hr Battery for **$34**. This is a used mug in Pre-Owned condition, which explains its lower price.\n\n**Best Deal:**\n\n* **Index 2:**  The used Ember Mug 2 for $34 is the best deal for your money. Even though it's pre-owned, it's significantly cheaper than other listings for new Ember mugs and offers the same functionality. The lower capacity (10oz) might be a consideration, but it's still a good deal for a working, used Ember Mug 2. \n002, 056, 078, 011, 012, 045\n",
+    *_example(
+        "Ember Mug 2", 2, [56, 78, 11, 12, 45],
+        "Travel mugs, accessories and for parts items are left out. Index 2, a Pre-Owned 10oz Ember Mug 2 for $34, "
+        "does the same as the new mugs for a fraction of their price.",
+    ),
     #*extract_pdf_pages("<path>/document4.pdf"),
-    "\n## Xbox Series S Analysis:\n\nI've filtered out listings that weren't for the Xbox Series S, listings for other consoles (Series X, One X), bundles with accessories, and \"For Parts\" items.\n\n**Highest Price:**\n\n* **Index 2:** Xbox Series S - 1TB (Black) for **$349**. This listing is for a brand new Series S with 1TB of storage, justifying its higher price compared to the standard 512GB model.\n\n**Lowest Price:**\n\n* **Index 22:** New Listing for **$79**.  This is a used console with no information about its condition, making it a risky purchase.\n\n**Best Deal:**\n\n* **Index 6:** Microsoft Xbox Series S 512GB Video Game Console - White for **$172**. This is a used console in Pre-Owned condition, offering a significant discount compared to brand new listings. It's the best deal because it's a working, used console at a lower price than other used options.\n\n006, 032, 067, 001, 089, 055\n",
-        *extract_excel_data(excel_file_path),
-    ]
-    response = model.generate_content(prompt_parts)
-    
-    return(response.text)
-
-print(printresponse())
\ No newline at end of file
+    *_example(
+        "Xbox Series S", 6, [32, 67, 1, 89, 55],
+        "Series X and One X consoles, bundles and for parts items are left out. Index 6, a Pre-Owned 512GB Series S "
+        "for $172, is a working console for less than the other used ones.",
+    ),
+]
+
+# How many pre-ranked listings the model gets to choose from
+TOP_K = 40
+
+MODEL_NAME = "gemini-1.5-flash"
+
+class GeminiBackend:
+    """Sends prompts to Gemini, the client is configured once and reused for every call."""
+
+    def __init__(self, api_key: str = ""):
+        import google.generativeai as genai
+
+        # Configure the API key
+        genai.configure(api_key=api_key)
+
+        # Initialize the model
+        self.model = genai.GenerativeModel(model_name=MODEL_NAME,
+                                           generation_config=GENERATION_CONFIG,
+                                           system_instruction=SYSTEM_INSTRUCTION)
+
+    def generate(self, prompt_parts: list[str]) -> str:
+        return self.model.generate_content(prompt_parts).text
+
+class StubBackend:
+    """Answers every prompt with the same text without calling a model, for tests and local runs."""
+
+    def __init__(self, text: str):
+        self.text = text
+        self.calls = 0
+
+    def generate(self, prompt_parts: list[str]) -> str:
+        self.calls += 1
+        return self.text
+
+_backend = None
+
+def get_backend():
+    """The model backend shared by every request, created on first use with the GEMINI_API_KEY environment variable."""
+    global _backend
+    if _backend is None:
+        _backend = GeminiBackend(os.environ.get("GEMINI_API_KEY", ""))
+    return _backend
+
+def set_backend(backend):
+    global _backend
+    _backend = backend
+
+class ResponseCache:
+    """TTL + LRU cache of model replies, identical calls in flight share one reply."""
+
+    def __init__(self, max_entries: int = 256, ttl: float = 60 * 60):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    def get_or_compute(self, key: str, compute):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.time():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            future = self._in_flight.get(key)
+            owner = future is None
+            if owner:
+                self.misses += 1
+                future = self._in_flight[key] = Future()
+            else:
+                self.hits += 1
+        if not owner:
+            return future.result()
+        try:
+            value = compute()
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(value)
+            with self._lock:
+                self._entries[key] = (time.time() + self.ttl, value)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+            return value
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+
+RESPONSES = ResponseCache()
+
+MODEL_SECONDS = metrics.histogram("ebayfinder_model_seconds", "Latency of one model call")
+PROMPT_CHARS = metrics.histogram(
+    "ebayfinder_prompt_chars", "Characters sent to the model per call", buckets=(1e3, 2e3, 5e3, 1e4, 2e4, 5e4, 1e5, 2e5)
+)
+REASKS = metrics.counter("ebayfinder_model_reasks_total", "Model replies that had to be asked again")
+
+def prompt_key(prompt_parts: list[str]) -> str:
+    """Fingerprint of everything that decides the model's reply."""
+    payload = json.dumps([MODEL_NAME, GENERATION_CONFIG, SYSTEM_INSTRUCTION, prompt_parts])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+# Every cell of the search results as its own prompt part, only kept to benchmark against
+def extract_results_data(df: "pd.DataFrame") -> list[str]:
+    data_str_list = [str(cell) for cell in df.values.flatten()]
+    return data_str_list
+
+def build_prompt_parts(df: "pd.DataFrame", product: str = None, top_k: int = TOP_K, prerank_results: bool = True) -> list[str]:
+    from prerank import prerank
+
+    if not prerank_results:
+        return [*EXAMPLE_PARTS, *extract_results_data(df)]
+    # the listings are filtered locally first so the prompt doesn't grow with the result count
+    return candidate_prompt_parts(prerank(df, product, top_k), product)
+
+def candidate_prompt_parts(candidates: "pd.DataFrame", product: str = None) -> list[str]:
+    from prerank import encode_candidates
+
+    product_parts = [f"{product}\n\n"] if product else []
+    return [*EXAMPLE_PARTS, *product_parts, encode_candidates(candidates)]
+
+class RankingError(ValueError):
+    """The model's reply isn't a usable ranking."""
+
+class Ranking:
+    """The model's pick as row indexes, best_deal is None when there was nothing to rank."""
+
+    def __init__(self, best_deal: Optional[int], recommendations: list[int], summary: str = ""):
+        self.best_deal = best_deal
+        self.recommendations = recommendations
+        self.summary = summary
+
+    @property
+    def indices(self) -> list[int]:
+        if self.best_deal is None:
+            return []
+        return [self.best_deal, *self.recommendations]
+
+    def to_dict(self) -> dict:
+        return {"best_deal": self.best_deal, "recommendations": self.recommendations, "summary": self.summary}
+
+def parse_ranking(text: str, candidates: set[int]) -> Ranking:
+    """Validate the model's JSON reply, every index has to be one of the `candidates` rows it was shown."""
+    try:
+        data = json.loads(text)
+    except ValueError as e:
+        raise RankingError(f"reply is not JSON: {e}")
+    if not isinstance(data, dict):
+        raise RankingError("reply is not a JSON object")
+    best_deal = data.get("best_deal")
+    recommendations = data.get("recommendations")
+    if not isinstance(recommendations, list):
+        raise RankingError("recommendations is not a list")
+    indices = [best_deal, *recommendations]
+    for index in indices:
+        if not isinstance(index, int) or isinstance(index, bool):
+            raise RankingError(f"index {index!r} is not an integer")
+        if index not in candidates:
+            raise RankingError(f"index {index} is not one of the listed products")
+    if len(set(indices)) < len(indices):
+        raise RankingError("an index is repeated, best_deal and every recommendation have to be different products")
+    # with fewer candidates than that every other one is a recommendation
+    wanted = min(RECOMMENDATIONS, len(candidates) - 1)
+    if len(recommendations) < wanted:
+        raise RankingError(f"only {len(recommendations)} recommendations, {wanted} are needed")
+    return Ranking(best_deal, recommendations[:RECOMMENDATIONS], str(data.get("summary") or ""))
+
+def generate(prompt_parts: list[str]) -> str:
+    PROMPT_CHARS.observe(sum(len(part) for part in prompt_parts))
+    with metrics.timer(MODEL_SECONDS):
+        return get_backend().generate(prompt_parts)
+
+def ask_for_ranking(prompt_parts: list[str], candidates: set[int]) -> Ranking:
+    """Run the model and parse its reply, a bad reply gets one re-ask with the error instead of a new scrape."""
+    text = generate(prompt_parts)
+    try:
+        return parse_ranking(text, candidates)
+    except RankingError as e:
+        log.warning(f"model gave an unusable ranking ({e}), asking again")
+        REASKS.inc()
+        correction = (
+            f"Your previous reply was not valid: {e}. Reply again with only the JSON object, "
+            f"using only indexes of the listed products."
+        )
+        return parse_ranking(generate([*prompt_parts, text, correction]), candidates)
+
+def rank(results_dir=store.RESULTS_DIR / "latest", product: str = None) -> Ranking:
+    from prerank import prerank
+
+    df = store.load(results_dir, "search")
+    candidates = prerank(df, product, TOP_K)
+    if candidates.empty:
+        log.info(f"no listings of {product!r} left to rank, not asking the model")
+        return Ranking(None, [], "No matching listings were found.")
+    prompt_parts = candidate_prompt_parts(candidates, product)
+    indexes = set(candidates["index"].astype(int))
+    # identical products and candidate rows get the cached (or in flight) ranking
+    return RESPONSES.get_or_compute(prompt_key(prompt_parts), lambda: ask_for_ranking(prompt_parts, indexes))
+
+def printresponse(results_dir=store.RESULTS_DIR / "latest", product: str = None):
+    return json.dumps(rank(results_dir, product).to_dict())
+
+if __name__ == "__main__":
+    print(printresponse())
\ No newline at end of file
@@ -0,0 +1,137 @@
+import asyncio
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from loguru import logger as log
+
+import metrics
+
+JOB_SECONDS = metrics.histogram("ebayfinder_job_seconds", "Run time of a job by final status")
+
+
+class JobQueueFull(Exception):
+    """Raised when too many jobs are already waiting to run."""
+
+
+class Job:
+    """A single scrape submitted to the worker pool."""
+
+    def __init__(self, name: str, job_id: str = None):
+        self.id = job_id or uuid.uuid4().hex
+        self.name = name
+        self.status = "queued"
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.finished = None
+        # spans of every timed stage the job went through, see metrics.trace()
+        self.trace = []
+
+    @property
+    def done(self) -> bool:
+        return self.status in ("done", "failed")
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "name": self.name,
+            "status": self.status,
+            "error": self.error,
+            "created": self.created,
+            "finished": self.finished,
+        }
+
+
+class JobRunner:
+    """Runs coroutines on one asyncio loop that lives for the whole process."""
+
+    def __init__(self, max_concurrent: int = 2, max_queued: int = 20, max_history: int = 100, on_evict=None):
+        self.max_concurrent = max_concurrent
+        self.max_queued = max_queued
+        self.max_history = max_history
+        self.on_evict = on_evict
+        self.jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="job-runner", daemon=True)
+        self._thread.start()
+        # built on the runner's loop, before 3.10 a semaphore binds to the loop current where it's created
+        self._semaphore = self._call(self._new_semaphore, max_concurrent)
+
+    def _call(self, func, *args):
+        """Run coroutine function `func(*args)` on the runner's loop and wait for its result."""
+        return asyncio.run_coroutine_threadsafe(func(*args), self._loop).result()
+
+    @staticmethod
+    async def _new_semaphore(value: int) -> asyncio.Semaphore:
+        return asyncio.Semaphore(value)
+
+    async def _try_acquire(self) -> bool:
+        if self._semaphore.locked():
+            return False
+        await self._semaphore.acquire()
+        return True
+
+    def submit(self, name: str, func, *args, job_id: str = None) -> Job:
+        """Schedule `func(*args)` (a coroutine function) and return its Job right away."""
+        with self._lock:
+            queued = sum(1 for job in self.jobs.values() if job.status == "queued")
+            if queued >= self.max_queued:
+                raise JobQueueFull(f"{queued} jobs already queued")
+            job = Job(name, job_id)
+            self.jobs[job.id] = job
+            evicted = self._evict()
+        for old_job in evicted:
+            try:
+                self.on_evict(old_job)
+            except Exception as e:
+                log.error(f"failed to clean up job {old_job.id}: {e}")
+        asyncio.run_coroutine_threadsafe(self._run(job, func, args), self._loop)
+        return job
+
+    def get(self, job_id: str):
+        return self.jobs.get(job_id)
+
+    def reserve(self):
+        """Take a job slot right away or raise JobQueueFull, give it back with release()."""
+        if not self._call(self._try_acquire):
+            raise JobQueueFull(f"all {self.max_concurrent} job slots are busy")
+
+    def release(self):
+        self._loop.call_soon_threadsafe(self._semaphore.release)
+
+    def iterate(self, agen):
+        """Drive an async generator on the worker loop and yield its items in this thread."""
+        try:
+            while True:
+                future = asyncio.run_coroutine_threadsafe(agen.__anext__(), self._loop)
+                try:
+                    yield future.result()
+                except StopAsyncIteration:
+                    return
+        finally:
+            # the client may disconnect halfway, make sure the generator releases its pages
+            asyncio.run_coroutine_threadsafe(agen.aclose(), self._loop).result()
+
+    async def _run(self, job: Job, func, args):
+        async with self._semaphore:
+            job.status = "running"
+            log.info("Job {} started: {}", job.id, job.name)
+            started = time.perf_counter()
+            with metrics.trace() as job.trace:
+                try:
+                    job.result = await func(*args)
+                    job.status = "done"
+                except Exception as e:
+                    log.error(f"Job {job.id} failed: {e}")
+                    job.error = str(e)
+                    job.status = "failed"
+            JOB_SECONDS.observe(time.perf_counter() - started, status=job.status)
+            job.finished = time.time()
+
+    def _evict(self) -> list:
+        finished = [job_id for job_id, job in self.jobs.items() if job.done]
+        evicted = [self.jobs.pop(job_id) for job_id in finished[:max(0, len(finished) - self.max_history)]]
+        return evicted if self.on_evict is not None else []
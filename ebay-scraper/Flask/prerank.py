@@ -0,0 +1,109 @@
+import os
+import re
+import sys
+import time
+
+import pandas as pd
+
+# Listings that aren't a working unit of the product itself
+FOR_PARTS_RE = re.compile(r"\b(?:for parts|parts only|not working|broken|as[- ]is)\b", re.IGNORECASE)
+ACCESSORY_RE = re.compile(
+    r"\b(?:case|cover|strap|charger|charging|cable|adapter|stand|mount|skin|decal|sticker|"
+    r"screen protector|tempered glass|replacement|box only|empty box|manual|lens protector|"
+    r"carrying bag|grip|dock|remote)s?\b",
+    re.IGNORECASE,
+)
+# An accessory named after one of these is included with the product, "... with Charger"
+BUNDLE_RE = re.compile(r"\b(?:with|incl|includes|including|plus|and|bundle)\b|\bw/|\+|&", re.IGNORECASE)
+WORD_RE = re.compile(r"[a-z0-9]+")
+# Accessories are only dropped when they cost less than this share of the median price
+ACCESSORY_PRICE_RATIO = 0.5
+# Modified z-score above which a price is an outlier (Iglewicz and Hoaglin)
+MAX_PRICE_Z = 3.5
+
+
+def _words(text) -> set:
+    return set(WORD_RE.findall(str(text).lower()))
+
+
+def is_accessory_title(title) -> bool:
+    """Whether the title is about an accessory rather than a product that comes with one."""
+    match = ACCESSORY_RE.search(str(title))
+    return match is not None and not BUNDLE_RE.search(str(title), 0, match.start())
+
+
+def robust_price_z(prices: pd.Series) -> pd.Series:
+    """Modified z-score of every price, based on the median and the median absolute deviation."""
+    median = prices.median()
+    mad = (prices - median).abs().median()
+    if not mad:
+        return pd.Series(0.0, index=prices.index)
+    return 0.6745 * (prices - median) / mad
+
+
+def prerank(df: pd.DataFrame, product: str = None, top_k: int = 40) -> pd.DataFrame:
+    """Drop listings the model would throw away anyway and keep the `top_k` cheapest of the rest."""
+    candidates = df[df["price"].notna() & df["title"].notna()]
+    # condition is categorical in stored tables, fillna("") would need "" to be one of its categories
+    text = candidates["title"].astype(str) + " " + candidates["condition"].astype(object).fillna("").astype(str)
+    candidates = candidates[~text.str.contains(FOR_PARTS_RE)]
+
+    product_words = _words(product) if product else set()
+    if not ACCESSORY_RE.search(product or ""):
+        # bundles keep their accessory words, only cheap listings of the accessory itself go
+        cheap = candidates["price"].astype(float) < candidates["price"].astype(float).median() * ACCESSORY_PRICE_RATIO
+        candidates = candidates[~(cheap & candidates["title"].map(is_accessory_title))]
+    if product_words:
+        overlap = candidates["title"].map(lambda title: len(product_words & _words(title)) / len(product_words))
+        candidates = candidates[overlap >= 0.5]
+
+    candidates = candidates.assign(_title=candidates["title"].str.lower().str.strip())
+    candidates = candidates.drop_duplicates(subset=["_title", "price"]).drop(columns="_title")
+
+    # a handful of listings doesn't say much about the price distribution
+    if len(candidates) >= 5:
+        candidates = candidates[robust_price_z(candidates["price"].astype(float)).abs() <= MAX_PRICE_Z]
+
+    return candidates.sort_values("price", kind="stable").head(top_k)
+
+
+def encode_candidates(df: pd.DataFrame) -> str:
+    """One line per listing, much smaller than sending every cell as its own prompt part."""
+    lines = ["index|price|condition|title"]
+    for row in df.itertuples(index=False):
+        condition = row.condition if isinstance(row.condition, str) else ""
+        lines.append(f"{int(row.index):03d}|{row.price}|{condition}|{row.title}")
+    return "\n".join(lines)
+
+
+def benchmark(results_dir, product: str, live: bool = False):
+    """Compare the prompt built from every cell with the pre-ranked one."""
+    import finresult
+
+    df = finresult.store.load(results_dir, "search")
+    started = time.perf_counter()
+    prompts = {
+        "all cells": finresult.build_prompt_parts(df, product, prerank_results=False),
+        "pre-ranked": finresult.build_prompt_parts(df, product),
+    }
+    print(f"building both prompts for {len(df)} rows took {(time.perf_counter() - started) * 1000:.1f}ms")
+    for name, parts in prompts.items():
+        if live:
+            backend = finresult.get_backend()
+            tokens = backend.model.count_tokens(parts).total_tokens
+            started = time.perf_counter()
+            backend.generate(parts)
+            latency = f", model call {time.perf_counter() - started:.2f}s"
+        else:
+            tokens = sum(len(part) for part in parts) // 4
+            latency = ""
+        print(f"{name}: {len(parts)} prompt parts, ~{tokens} tokens{latency}")
+
+
+if __name__ == "__main__":
+    # finresult needs metrics.py and store.py from one level up
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+    if len(sys.argv) < 3:
+        print("Usage: python prerank.py <results_dir> <product> [--live]")
+        sys.exit(1)
+    benchmark(sys.argv[1], sys.argv[2], live="--live" in sys.argv)
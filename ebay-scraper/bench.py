@@ -0,0 +1,218 @@
+"""Benchmark report for the scraping pipeline, run fully offline through replay.ReplayClient.
+
+Usage:
+    python bench.py [--fixtures DIR] [--latency SECONDS] [--processes N] [--json OUT]
+    python bench.py --startup [--json OUT]
+
+Measures per-page parse time (search, product and variant pages), end-to-end
+search throughput at 1, 10 and 50 pages and the memory peak of the 50 page search.
+Parse benchmarks use recorded pages from --fixtures when given, synthetic pages
+otherwise. --processes also runs the searches with pages parsed in a process
+pool of that size. --json writes the numbers to a file. The same parse and search
+benchmarks run under pytest-benchmark in tests/test_benchmarks.py, which is what CI tracks.
+
+--startup instead measures the import time of every entry point in a fresh
+interpreter (python -X importtime) and exits with status 1 when one is over its
+budget in STARTUP_BUDGETS_MS.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+from loguru import logger as log
+
+import ebay
+from cache import CachedResponse
+from ebay import _update_url_param, parse_product, parse_search, parse_variants, scrape_search
+from replay import ReplayClient
+
+SEARCH_URL = "https://www.ebay.com/sch/i.html?_nkw=bench&_ipg=60"
+PAGE_COUNTS = (1, 10, 50)
+# Import time budget of each entry point in milliseconds, workers are started and stopped often
+STARTUP_BUDGETS_MS = {"ebay": 350, "run": 450, "watch": 450, "app": 600}
+HERE = Path(__file__).parent
+
+
+def synthetic_search_page(page: int, items: int = 60, total_results: int = 3000) -> str:
+    boxes = []
+    for i in range(items):
+        number = page * items + i
+        extra = '<span class="s-item__time-end">Ends (Today 5:00PM)</span>' if number % 7 == 0 else ""
+        boxes.append(
+            f'<li class="s-item s-item__pl-on-bottom"><div class="s-item__wrapper clearfix">'
+            f'<div class="s-item__image-section"><img src="https://i.ebayimg.com/{number}.jpg"></div>'
+            f'<div class="s-item__info clearfix"><a class="s-item__link" href="https://www.ebay.com/itm/{100000 + number}?hash=item">'
+            f'<div class="s-item__title"><span role="heading"><span class="LIGHT_HIGHLIGHT">New Listing</span>'
+            f'Bench Product {number} 128GB</span></div></a>'
+            f'<div class="s-item__subtitle"><span class="SECONDARY_INFO">Pre-Owned</span></div>'
+            f'<div class="s-item__details"><span class="s-item__price">${100 + number % 400}.99</span>{extra}'
+            f'<span class="s-item__location s-item__itemLocation">from United States</span></div></div></div></li>'
+        )
+    return (
+        f'<html><body><div class="srp-controls__count-heading"><span>{total_results:,}</span> results</div>'
+        f'<ul class="srp-results srp-list clearfix">{"".join(boxes)}</ul></body></html>'
+    )
+
+
+def synthetic_product_page(variants: int = 60, features: int = 30) -> str:
+    msku = {
+        "selectMenus": [{"displayLabel": "Storage", "menuItemValueIds": [1, 2, 3]}],
+        "menuItemMap": {
+            str(i): {"valueId": i, "valueName": f"{64 * i}GB", "matchingVariationIds": list(range(i, variants, 3))}
+            for i in (1, 2, 3)
+        },
+        "variationsMap": {
+            str(v): {
+                "binModel": {"price": {"value": {
+                    "convertedFromValue": f"${300 + v}.00", "convertedFromCurrency": "USD",
+                    "value": f"EUR {280 + v}.00", "currency": "EUR",
+                }}},
+                "quantity": {"outOfStock": v % 5 == 0},
+            }
+            for v in range(variants)
+        },
+    }
+    filler = json.dumps({"widgets": [{"id": i, "data": {"text": "{" * 3 + "x" * 40}} for i in range(500)]})
+    rows = "".join(
+        f'<div class="ux-labels-values__labels"><span class="ux-textspans">Feature {i}:</span></div>'
+        f'<div class="ux-labels-values__values"><span class="ux-textspans">Value {i}</span></div>'
+        for i in range(features)
+    )
+    photos = "".join(f'<div class="ux-image-carousel-item image"><img src="https://i/{i}.jpg"></div>' for i in range(12))
+    return (
+        '<html><head><link rel="canonical" href="https://www.ebay.com/itm/393531906094"></head><body>'
+        '<h1><span class="ux-textspans">Bench Phone</span></h1>'
+        '<div class="x-price-primary"><span class="ux-textspans">US $399.99</span></div>'
+        '<div data-testid="str-title"><a href="https://www.ebay.com/str/bench?x=1">Bench Store</a></div>'
+        f'{photos}<div class="d-item-description"><iframe src="https://vi.vipr.ebaydesc.com/1"></iframe></div>'
+        f'<div class="ux-layout-section--features">{rows}</div>'
+        f'<script>window.a = {filler}; $vim_C = {{"o": {{"MSKU": {json.dumps(msku)}}}}};</script></body></html>'
+    )
+
+
+def time_call(func, repeat: int = 20) -> dict:
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+    return {"median_ms": statistics.median(timings) * 1000, "min_ms": min(timings) * 1000}
+
+
+def bench_parsing(fixtures: ReplayClient = None) -> dict:
+    """Parse time from raw HTML, so the lxml tree build is included."""
+    if fixtures is not None:
+        search_pages = [html for url, html in fixtures._pages.items() if "/sch/" in url]
+        product_pages = [html for url, html in fixtures._pages.items() if "/itm/" in url]
+    else:
+        search_pages = [synthetic_search_page(0, 60), synthetic_search_page(0, 240)]
+        product_pages = [synthetic_product_page()]
+    results = {}
+    for i, html in enumerate(search_pages):
+        results[f"parse_search[{i}]"] = time_call(lambda: parse_search(CachedResponse(SEARCH_URL, html)))
+    for i, html in enumerate(product_pages):
+        results[f"parse_product[{i}]"] = time_call(lambda: parse_product(CachedResponse(SEARCH_URL, html), 1))
+        results[f"parse_variants[{i}]"] = time_call(lambda: parse_variants(CachedResponse(SEARCH_URL, html)))
+    return results
+
+
+def bench_search(latency: float, pool=None) -> dict:
+    """End-to-end scrape_search over replayed pages, nothing is cached between runs."""
+    pages = {SEARCH_URL: synthetic_search_page(0)}
+    for page in range(2, max(PAGE_COUNTS) + 1):
+        pages[_update_url_param(SEARCH_URL, _pgn=page)] = synthetic_search_page(page - 1)
+    results = {}
+    for page_count in PAGE_COUNTS:
+        ebay.SCRAPFLY = ReplayClient(pages=pages, latency=latency, max_concurrency=5, seed=1)
+        ebay.CACHE = None
+        tracemalloc.start()
+        started = time.perf_counter()
+        listings = asyncio.run(scrape_search(SEARCH_URL, 1, max_pages=page_count, pool=pool))
+        elapsed = time.perf_counter() - started
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        results[f"search[{page_count} pages{', parse pool' if pool else ''}]"] = {
+            "seconds": elapsed,
+            "pages_per_second": page_count / elapsed,
+            "listings_per_second": len(listings) / elapsed,
+            "peak_memory_mb": peak / 1024 / 1024,
+        }
+    return results
+
+
+def import_time_ms(module: str, cwd: Path) -> float:
+    """Cumulative import time of `module` in a fresh interpreter, read from python -X importtime."""
+    # the web app's warm start imports in a background thread, that isn't part of its startup
+    env = {**os.environ, "EBAYFINDER_WARM_START": "0"}
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=cwd, env=env, capture_output=True, text=True, check=True,
+    )
+    for line in result.stderr.splitlines():
+        # "import time:  self | cumulative | name", nested imports have a longer indent before the name
+        fields = line.split("|")
+        if line.startswith("import time:") and len(fields) == 3 and fields[2].rstrip() == f" {module}":
+            return int(fields[1]) / 1000
+    raise RuntimeError(f"no import time reported for {module}")
+
+
+def bench_startup(repeat: int = 3) -> dict:
+    results = {}
+    for module, budget in STARTUP_BUDGETS_MS.items():
+        cwd = HERE / "Flask" if module == "app" else HERE
+        results[f"import {module}"] = {
+            "ms": min(import_time_ms(module, cwd) for _ in range(repeat)),
+            "budget_ms": budget,
+        }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--fixtures", help="directory recorded with replay.RecordingClient")
+    parser.add_argument("--latency", type=float, default=0.05, help="replayed seconds per page fetch")
+    parser.add_argument("--processes", type=int, help="also benchmark searches parsed in this many processes")
+    parser.add_argument("--startup", action="store_true", help="check the entry points' import time budgets")
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args()
+
+    # log lines would add to the timings
+    log.remove()
+    log.add(sys.stderr, level="WARNING")
+
+    if args.startup:
+        results = {"startup": bench_startup()}
+    else:
+        fixtures = ReplayClient(args.fixtures) if args.fixtures else None
+        results = {"parse": bench_parsing(fixtures), "search": bench_search(args.latency)}
+        if args.processes:
+            pool = ebay.parse_pool(args.processes)
+            # start the workers first, spawning them isn't what's being measured
+            list(pool.map(abs, range(args.processes)))
+            results["search_pool"] = bench_search(args.latency, pool)
+            pool.shutdown()
+    for group in results.values():
+        for name, numbers in group.items():
+            print(f"{name:32} " + "  ".join(f"{key} {value:.2f}" for key, value in numbers.items()))
+    if args.json:
+        results["python"] = platform.python_version()
+        results["latency"] = args.latency
+        results["processes"] = args.processes
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    over_budget = [name for name, numbers in results.get("startup", {}).items() if numbers["ms"] > numbers["budget_ms"]]
+    if over_budget:
+        print("over the startup budget:", ", ".join(over_budget))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+import sqlite3
+import threading
+import time
+import zlib
+from abc import ABC, abstractmethod
+from collections import Counter, OrderedDict
+from functools import cached_property
+from pathlib import Path
+from typing import Dict, Optional, Tuple, Union
+
+# How long a fetched page stays fresh, in seconds, per page type
+DEFAULT_TTLS = {
+    "search": 10 * 60,
+    "product": 60 * 60,
+    "description": 24 * 60 * 60,
+}
+
+
+class CachedResponse:
+    """Stands in for a ScrapeApiResponse when the page comes from the cache."""
+
+    def __init__(self, url: str, content: str):
+        self.content = content
+        self.context = {"url": url}
+        self.config = {"url": url}
+
+    @cached_property
+    def selector(self):
+        from parsel import Selector
+        return Selector(text=self.content)
+
+
+class BaseCache(ABC):
+    """Raw HTML cache keyed by request, with a TTL per page type and hit/miss counters."""
+
+    def __init__(self, max_entries: int = 1000, ttls: Optional[Dict[str, int]] = None):
+        self.max_entries = max_entries
+        self.ttls = {**DEFAULT_TTLS, **(ttls or {})}
+        self.hits = Counter()
+        self.misses = Counter()
+        self._lock = threading.Lock()
+
+    def get(self, key: str, page_type: str) -> Optional[CachedResponse]:
+        with self._lock:
+            entry = self._get(key, time.time())
+        if entry is None:
+            self.misses[page_type] += 1
+            return None
+        self.hits[page_type] += 1
+        return CachedResponse(*entry)
+
+    def set(self, key: str, page_type: str, url: str, content: str):
+        ttl = self.ttls.get(page_type, 0)
+        if ttl <= 0:
+            return
+        with self._lock:
+            self._set(key, page_type, url, content, time.time() + ttl)
+
+    def stats(self) -> Dict:
+        hits, misses = sum(self.hits.values()), sum(self.misses.values())
+        with self._lock:
+            entries = len(self)
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / (hits + misses) if hits + misses else 0.0,
+            "by_page_type": {
+                page_type: {"hits": self.hits[page_type], "misses": self.misses[page_type]}
+                for page_type in sorted(set(self.hits) | set(self.misses))
+            },
+            "entries": entries,
+        }
+
+    @abstractmethod
+    def _get(self, key: str, now: float) -> Optional[Tuple[str, str]]:
+        """(url, content) of a fresh entry, None when the key is missing or expired."""
+
+    @abstractmethod
+    def _set(self, key: str, page_type: str, url: str, content: str, expires: float):
+        """Store an entry, evicting the least recently used ones beyond max_entries."""
+
+    @abstractmethod
+    def __len__(self):
+        """Number of stored entries, expired ones that weren't evicted yet included."""
+
+
+class MemoryCache(BaseCache):
+    """In-process LRU cache, lost when the process exits."""
+
+    def __init__(self, max_entries: int = 1000, ttls: Optional[Dict[str, int]] = None):
+        super().__init__(max_entries, ttls)
+        self._entries = OrderedDict()
+
+    def _get(self, key, now):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires, url, content = entry
+        if expires < now:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return url, content
+
+    def _set(self, key, page_type, url, content, expires):
+        self._entries[key] = (expires, url, content)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SQLiteCache(BaseCache):
+    """On-disk LRU cache in a single SQLite file, pages are stored zlib compressed."""
+
+    def __init__(self, path: Union[str, Path], max_entries: int = 10000, ttls: Optional[Dict[str, int]] = None):
+        super().__init__(max_entries, ttls)
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY, page_type TEXT, url TEXT, content BLOB,"
+            " expires REAL, accessed REAL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+        self._db.commit()
+
+    def _get(self, key, now):
+        row = self._db.execute("SELECT url, content, expires FROM responses WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        url, content, expires = row
+        if expires < now:
+            self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self._db.commit()
+            return None
+        self._db.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+        self._db.commit()
+        return url, zlib.decompress(content).decode("utf-8")
+
+    def _set(self, key, page_type, url, content, expires):
+        self._db.execute(
+            "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+            (key, page_type, url, zlib.compress(content.encode("utf-8")), expires, time.time()),
+        )
+        self._db.execute(
+            "DELETE FROM responses WHERE key IN ("
+            " SELECT key FROM responses ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,),
+        )
+        self._db.commit()
+
+    def __len__(self):
+        return self._db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
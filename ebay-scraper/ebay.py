@@ -1,24 +1,56 @@
+import asyncio
+import hashlib
 import json
 import math
+import multiprocessing
 import os
+import re
 import sys
+import time
 from collections import defaultdict
-from typing import Dict, List, Optional, Union
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import TYPE_CHECKING, AsyncIterator, Dict, List, Optional, Union
 from urllib.parse import parse_qsl, urlencode, urlparse, urlunparse
 
-import dateutil
-from nested_lookup import nested_lookup
+import metrics
+from cache import CachedResponse, MemoryCache
+from models import Listing, Product, listings_frame
+from lxml import etree
+from parsel.csstranslator import css2xpath
 from loguru import logger as log
-from scrapfly import ScrapeApiResponse, ScrapeConfig, ScrapflyClient, ScrapflyScrapeError
-import pandas as pd
 
-SCRAPFLY_KEY = ""
-SCRAPFLY = ScrapflyClient(key=SCRAPFLY_KEY)
+# scrapfly takes as long to import as everything else here, it's imported where a page is fetched
+if TYPE_CHECKING:
+    from scrapfly import ScrapeApiResponse
+
+SCRAPFLY_KEY = os.environ.get("SCRAPFLY_KEY", "")
+# Created on first use by _client(), replay.ReplayClient or any client with the same methods can be assigned
+SCRAPFLY = None
 BASE_CONFIG = {
     "asp": True,
     "country": "US",
     "lang": ["en-US"],
 }
+# Raw page cache in front of Scrapfly, swap for cache.SQLiteCache to keep pages between runs
+# or set to None to always fetch
+CACHE = MemoryCache()
+
+FETCH_SECONDS = metrics.histogram(
+    "ebayfinder_fetch_seconds",
+    "Scrapfly fetch latency by page type, batched pages count from the start of their batch",
+)
+FETCH_ERRORS = metrics.counter("ebayfinder_fetch_errors_total", "Failed Scrapfly fetches by page type")
+CACHE_REQUESTS = metrics.counter("ebayfinder_cache_requests_total", "Page cache lookups by page type and result")
+PARSE_SECONDS = metrics.histogram("ebayfinder_parse_seconds", "Time to parse one page by page type")
+LISTINGS = metrics.counter("ebayfinder_search_listings_total", "Search listings kept or filtered out, by reason")
+
+def _client():
+    global SCRAPFLY
+    if SCRAPFLY is None:
+        from scrapfly import ScrapflyClient
+
+        SCRAPFLY = ScrapflyClient(key=SCRAPFLY_KEY)
+    return SCRAPFLY
 
 def _find_json_objects(text: str, decoder=json.JSONDecoder()):
     pos = 0
@@ -27,12 +59,39 @@ def _find_json_objects(text: str, decoder=json.JSONDecoder()):
         if match == -1:
             break
         try:
-            result, index = decoder.raw_decode(text[match:])
+            # decode in place, slicing would copy the rest of the script for every "{"
+            result, pos = decoder.raw_decode(text, match)
             yield result
-            pos = match + index
         except ValueError:
             pos = match + 1
 
+def _find_json_value(text: str, key: str, decoder=json.JSONDecoder()):
+    """Decode the value of the first `"key": {...}` in text without decoding anything around it."""
+    needle = json.dumps(key)
+    pos = 0
+    while True:
+        match = text.find(needle, pos)
+        if match == -1:
+            return None
+        pos = match + len(needle)
+        while pos < len(text) and text[pos].isspace():
+            pos += 1
+        if pos < len(text) and text[pos] == ":":
+            pos += 1
+            while pos < len(text) and text[pos].isspace():
+                pos += 1
+            try:
+                return decoder.raw_decode(text, pos)[0]
+            except ValueError:
+                pass
+
+ITEM_ID_RE = re.compile(r"/itm/(?:[^/?#]+/)?(\d+)")
+
+def item_id(url: str) -> Optional[str]:
+    """eBay item id from a listing URL, /itm/<id> or /itm/<slug>/<id>."""
+    match = ITEM_ID_RE.search(url or "")
+    return match.group(1) if match else None
+
 def clean_price(price: Union[str, int, float]) -> float:
     """Remove non-numeric characters from price string and convert to float."""
     if isinstance(price, (int, float)):
@@ -40,12 +99,20 @@ def clean_price(price: Union[str, int, float]) -> float:
     clean_price = ''.join(c for c in price if c.isdigit() or c == '.')
     return float(clean_price)
 
-def parse_variants(result: ScrapeApiResponse) -> dict:
+@metrics.timed(PARSE_SECONDS, page_type="variants")
+def parse_variants(result: "ScrapeApiResponse") -> dict:
     script = result.selector.xpath('//script[contains(., "MSKU")]/text()').get()
     if not script:
         return {}
-    all_data = list(_find_json_objects(script))
-    data = nested_lookup("MSKU", all_data)[0]
+    data = _find_json_value(script, "MSKU")
+    if not isinstance(data, dict):
+        from nested_lookup import nested_lookup
+
+        # MSKU isn't a plain key/value pair in this script, look through every object in it
+        found = nested_lookup("MSKU", list(_find_json_objects(script)))
+        if not found:
+            return {}
+        data = found[0]
     selection_names = {}
     for menu in data["selectMenus"]:
         for id_ in menu["menuItemValueIds"]:
@@ -55,12 +122,16 @@ def parse_variants(result: ScrapeApiResponse) -> dict:
         selections.append(
             {
                 "name": v["valueName"],
-                "variants": v["matchingVariationIds"],
+                "variants": set(v["matchingVariationIds"]),
                 "label": selection_names[v["valueId"]],
             }
         )
     results = []
-    variant_data = nested_lookup("variationsMap", data)[0]
+    variant_data = data.get("variationsMap")
+    if not variant_data:
+        from nested_lookup import nested_lookup
+
+        variant_data = nested_lookup("variationsMap", data)[0]
     for id_, variant in variant_data.items():
         result = defaultdict(list)
         result["id"] = id_
@@ -75,90 +146,191 @@ def parse_variants(result: ScrapeApiResponse) -> dict:
         results.append(dict(result))
     return results
 
-def parse_product(result: ScrapeApiResponse, min_price: int):
-    sel = result.selector
-    css_join = lambda css: "".join(sel.css(css).getall()).strip()
-    css = lambda css: sel.css(css).get("").strip()
-    item = {}
-    item["url"] = css('link[rel="canonical"]::attr(href)')
-    item["id"] = item["url"].split("/itm/")[1].split("?")[0]
-    price_original = css(".x-price-primary>span::text")
-    if price_original:
-        item["price_original"] = int(clean_price(price_original))
-    else:
-        item["price_original"] = None
-    price_converted = css(".x-price-approx__price ::text")
-    if price_converted:
-        item["price_converted"] = int(clean_price(price_converted))
-    else:
-        item["price_converted"] = None
-    item["name"] = css_join("h1 span::text")
-    item["seller_name"] = css_join("[data-testid=str-title] a ::text")
-    item["seller_url"] = css("[data-testid=str-title] a::attr(href)").split("?")[0]
-    item["photos"] = sel.css('.ux-image-filmstrip-carousel-item.image img::attr("src")').getall()
-    item["photos"].extend(sel.css('.ux-image-carousel-item.image img::attr("src")').getall())
-    item["description_url"] = css("div.d-item-description iframe::attr(src)")
-    if not item["description_url"]:
-        item["description_url"] = css("div#desc_div iframe::attr(src)")
-    feature_table = sel.css("div.ux-layout-section--features")
+def _compile_css(query: str) -> etree.XPath:
+    """Translate a CSS selector (with parsel's ::text and ::attr() extensions) to a compiled XPath once."""
+    return etree.XPath(css2xpath(query), smart_strings=False)
+
+def _first(xpath: etree.XPath, node, default: str = "") -> str:
+    found = xpath(node)
+    return found[0] if found else default
+
+# Selectors are compiled at import and evaluated directly on the lxml tree,
+# parsel would translate CSS to XPath again on every .css() call.
+PRODUCT_CANONICAL = _compile_css('link[rel="canonical"]::attr(href)')
+PRODUCT_PRICE = _compile_css(".x-price-primary>span::text")
+PRODUCT_PRICE_CONVERTED = _compile_css(".x-price-approx__price ::text")
+PRODUCT_NAME = _compile_css("h1 span::text")
+PRODUCT_SELLER_NAME = _compile_css("[data-testid=str-title] a ::text")
+PRODUCT_SELLER_URL = _compile_css("[data-testid=str-title] a::attr(href)")
+PRODUCT_PHOTOS = _compile_css('.ux-image-filmstrip-carousel-item.image img::attr("src")')
+PRODUCT_PHOTOS_CAROUSEL = _compile_css('.ux-image-carousel-item.image img::attr("src")')
+PRODUCT_DESCRIPTION_URL = _compile_css("div.d-item-description iframe::attr(src)")
+PRODUCT_DESCRIPTION_URL_OLD = _compile_css("div#desc_div iframe::attr(src)")
+PRODUCT_FEATURE_TABLES = _compile_css("div.ux-layout-section--features")
+PRODUCT_FEATURE_LABELS = _compile_css(".ux-labels-values__labels")
+PRODUCT_FEATURE_TEXT = _compile_css(".ux-textspans::text")
+PRODUCT_FEATURE_VALUE_TEXT = etree.XPath("following-sibling::div[1]/" + css2xpath(".ux-textspans::text"), smart_strings=False)
+
+@metrics.timed(PARSE_SECONDS, page_type="product")
+def parse_product(result: "ScrapeApiResponse", min_price: int) -> Optional[Product]:
+    root = result.selector.root
+    css_join = lambda xpath: "".join(xpath(root)).strip()
+    css = lambda xpath: _first(xpath, root).strip()
+    url = css(PRODUCT_CANONICAL)
+    price_original = css(PRODUCT_PRICE)
+    price_converted = css(PRODUCT_PRICE_CONVERTED)
+    photos = PRODUCT_PHOTOS(root)
+    photos.extend(PRODUCT_PHOTOS_CAROUSEL(root))
     features = {}
-    for ft_label in feature_table.css(".ux-labels-values__labels"):
-        label = "".join(ft_label.css(".ux-textspans::text").getall()).strip(":\n ")
-        ft_value = ft_label.xpath("following-sibling::div[1]")
-        value = "".join(ft_value.css(".ux-textspans::text").getall()).strip()
-        features[label] = value
-    item["features"] = features
+    for feature_table in PRODUCT_FEATURE_TABLES(root):
+        for ft_label in PRODUCT_FEATURE_LABELS(feature_table):
+            label = "".join(PRODUCT_FEATURE_TEXT(ft_label)).strip(":\n ")
+            value = "".join(PRODUCT_FEATURE_VALUE_TEXT(ft_label)).strip()
+            features[label] = value
+    item = Product(
+        url=url,
+        id=item_id(url),
+        price_original=int(clean_price(price_original)) if price_original else None,
+        price_converted=int(clean_price(price_converted)) if price_converted else None,
+        name=css_join(PRODUCT_NAME),
+        seller_name=css_join(PRODUCT_SELLER_NAME),
+        seller_url=css(PRODUCT_SELLER_URL).split("?")[0],
+        photos=photos,
+        description_url=css(PRODUCT_DESCRIPTION_URL) or css(PRODUCT_DESCRIPTION_URL_OLD),
+        features=features,
+    )
 
     # Ignore listings where the price is less than the min_price
-    if item["price_converted"] and item["price_converted"] < int(min_price):
-        log.info(f"Product {item['id']} ignored due to price {item['price_converted']} being less than {min_price}")
+    if item.price_converted and item.price_converted < int(min_price):
+        log.info(f"Product {item.id} ignored due to price {item.price_converted} being less than {min_price}")
         return None
 
     return item
 
-async def fetch_description(description_url: str) -> str:
+async def fetch_description(description_url: str, scheduler: Optional["FetchScheduler"] = None) -> str:
     """Fetch the product description from the given iframe URL."""
-    description_page = await SCRAPFLY.async_scrape(ScrapeConfig(description_url, **BASE_CONFIG))
+    if scheduler is not None:
+        description_page = await scheduler.fetch(description_url, "description")
+    else:
+        description_page = await _scrape(description_url, "description")
     sel = description_page.selector
     description = "".join(sel.css("body *::text").getall()).strip()
     return description
 
-async def scrape_product(url: str, min_price: int) -> Dict:
-    page = await SCRAPFLY.async_scrape(ScrapeConfig(url, **BASE_CONFIG))
+def _parse_product_html(url: str, html: str, min_price: int):
+    page = CachedResponse(url, html)
     product = parse_product(page, min_price)
+    return product, parse_variants(page) if product is not None else []
+
+async def scrape_product(
+    url: str, min_price: int, scheduler: Optional["FetchScheduler"] = None, pool: Optional[Executor] = None
+) -> Optional[Product]:
+    """Scrape an item page with its description, the page is parsed in `pool` when one is given."""
+    if scheduler is not None:
+        page = await scheduler.fetch(url, "product")
+    else:
+        page = await _scrape(url, "product")
+    if pool is not None:
+        loop = asyncio.get_running_loop()
+        product, variants = await loop.run_in_executor(
+            pool, _parse_product_html, page.context["url"], page.content, min_price
+        )
+    else:
+        product = parse_product(page, min_price)
+        variants = parse_variants(page) if product is not None else []
 
     if product is None:
         return None
 
-    if product["description_url"]:
+    if product.description_url:
         try:
-            description = await fetch_description(product["description_url"])
-            product["description"] = description
+            product.description = await fetch_description(product.description_url, scheduler)
         except Exception as e:
-            log.error(f"Failed to fetch description from {product['description_url']}: {e}")
-            product["description"] = None
-    else:
-        product["description"] = None
+            log.error(f"Failed to fetch description from {product.description_url}: {e}")
 
-    product["variants"] = parse_variants(page)
+    product.variants = variants
     return product
 
-def parse_search(result: ScrapeApiResponse, start_index: int = 1, min_price: int = 1) -> List[Dict]:
+async def scrape_products(
+    urls: List[str],
+    min_price: int = 1,
+    concurrency: int = 10,
+    rate: float = 5.0,
+    retries: int = 3,
+    pool: Optional[Executor] = None,
+) -> AsyncIterator[Product]:
+    """Scrape many product pages at once and yield each product as soon as it is complete."""
+    scheduler = FetchScheduler(concurrency=concurrency, rate=rate, retries=retries)
+    tasks = [asyncio.create_task(scrape_product(url, min_price, scheduler, pool)) for url in urls]
+    try:
+        for task in asyncio.as_completed(tasks):
+            try:
+                product = await task
+            except Exception as e:
+                log.error(f"failed to scrape product: {e}")
+                continue
+            if product is not None:
+                yield product
+    finally:
+        for task in tasks:
+            task.cancel()
+
+SEARCH_BOXES = _compile_css(".srp-results li.s-item")
+SEARCH_CLASSES = {
+    "s-item__auction",
+    "s-item__time-end",
+    "s-item__price",
+    "s-item__link",
+    "s-item__title",
+    "s-item__itemLocation",
+    "SECONDARY_INFO",
+}
+SEARCH_TITLE_TEXT = etree.XPath("descendant::span/text()", smart_strings=False)
+AUCTION_END_RE = re.compile(r"\((.+?)\)")
+
+def _texts(elements):
+    """Text nodes directly under the elements, what parsel's ::text selects."""
+    for element in elements:
+        if element.text is not None:
+            yield element.text
+        for child in element:
+            if child.tail is not None:
+                yield child.tail
+
+def _scan_search_box(box):
+    """Walk a result box once and collect the elements parse_search reads, in document order."""
+    found = defaultdict(list)
+    images = []
+    for element in box.iter(etree.Element):
+        if element.tag == "img":
+            images.append(element)
+        classes = element.get("class")
+        if classes:
+            for name in classes.split():
+                if name in SEARCH_CLASSES:
+                    found[name].append(element)
+    return found, images
+
+@metrics.timed(PARSE_SECONDS, page_type="search")
+def parse_search(result: "ScrapeApiResponse", start_index: int = 1, min_price: int = 1) -> List[Listing]:
     previews = []
     index = start_index
-    for box in result.selector.css(".srp-results li.s-item"):
-        css = lambda css: box.css(css).get("").strip() or None
-        css_re = lambda css, pattern: box.css(css).re_first(pattern, default="").strip()
+    min_price = int(min_price)
+    auctions = too_cheap = 0
+    for box in SEARCH_BOXES(result.selector.root):
+        found, images = _scan_search_box(box)
+        text = lambda name: next(_texts(found[name]), "").strip() or None
 
-        auction = css(".s-item__auction")
-        auction_end = css_re(".s-item__time-end::text", r"\((.+?)\)") or None
+        auction_end = next(
+            (match.group(1) for match in map(AUCTION_END_RE.search, _texts(found["s-item__time-end"])) if match), ""
+        ).strip()
 
-        # Ignore auction listings
-        if auction or auction_end:
-            log.info(f"Listing ignored because it's an auction.")
+        # Ignore auction listings, planned searches (see plan_search) ask eBay for Buy It Now only
+        if found["s-item__auction"] or auction_end:
+            auctions += 1
             continue
 
-        price = css(".s-item__price::text")
+        price = text("s-item__price")
         if price:
             try:
                 price = int(clean_price(price))
@@ -168,21 +340,35 @@ def parse_search(result: ScrapeApiResponse, start_index: int = 1, min_price: int
             price = None
 
         # Ignore listings where the price is less than the min_price
-        if price and int(price) < int(min_price):
-            log.info(f"Listing ignored due to price {price} being less than {min_price}")
+        if price and price < min_price:
+            too_cheap += 1
             continue
 
-        item = {
-            "index": index,
-            "url": css("a.s-item__link::attr(href)").split("?")[0],
-            "title": css(".s-item__title span::text"),
-            "price": price,
-            "location": css(".s-item__itemLocation::text"),
-            "photo": box.css("img::attr(data-src)").get() or box.css("img::attr(src)").get(),
-            "condition": css(".SECONDARY_INFO::text"),
-        }
-        previews.append(item)
+        links = (link.get("href") for link in found["s-item__link"] if link.tag == "a" and link.get("href") is not None)
+        # titles nest spans ("New Listing" is a span inside the heading span), so keep XPath's text order
+        titles = (text for title in found["s-item__title"] for text in SEARCH_TITLE_TEXT(title))
+        url = (next(links, "").strip() or None).split("?")[0]
+        previews.append(
+            Listing(
+                index=index,
+                id=item_id(url),
+                url=url,
+                title=next(titles, "").strip() or None,
+                price=price,
+                location=text("s-item__itemLocation"),
+                photo=next((img.get("data-src") for img in images if img.get("data-src") is not None), None)
+                or next((img.get("src") for img in images if img.get("src") is not None), None),
+                condition=text("SECONDARY_INFO"),
+            )
+        )
         index += 1
+    # counted per page, a log line per listing costs more than parsing it
+    LISTINGS.inc(len(previews), result="kept")
+    LISTINGS.inc(auctions, result="auction")
+    LISTINGS.inc(too_cheap, result="below_min_price")
+    log.debug(
+        "Search page: kept {} listings, ignored {} auctions and {} under {}", len(previews), auctions, too_cheap, min_price
+    )
     return previews
 
 def _get_url_parameter(url: str, param: str, default=None) -> Optional[str]:
@@ -196,41 +382,327 @@ def _update_url_param(url: str, **params):
     updated_url = parsed_url._replace(query=urlencode(query_params))
     return urlunparse(updated_url)
 
-async def scrape_search(url: str, min_price: int, max_pages: Optional[int] = None, start_index: int = 1) -> List[Dict]:
-    log.info("Scraping search for {}", url)
-    first_page = await SCRAPFLY.async_scrape(ScrapeConfig(url, **BASE_CONFIG))
-    results = parse_search(first_page, start_index, min_price)
+def _normalize_url(url: str) -> str:
+    """Drop the fragment and sort the query so equivalent URLs compare equal."""
+    parsed_url = urlparse(url)
+    query_params = dict(sorted(parse_qsl(parsed_url.query)))
+    return _update_url_param(urlunparse(parsed_url._replace(query="", fragment="")), **query_params)
+
+def _cache_key(url: str) -> str:
+    config = json.dumps(BASE_CONFIG, sort_keys=True)
+    return hashlib.sha1(f"{_normalize_url(url)} {config}".encode("utf-8")).hexdigest()
+
+async def _scrape(url: str, page_type: str, throttle=None):
+    """Fetch a single page through the cache, `throttle` is awaited only when the page has to be fetched."""
+    from scrapfly import ScrapeConfig, ScrapflyScrapeError
+
+    if CACHE is not None:
+        cached = CACHE.get(_cache_key(url), page_type)
+        CACHE_REQUESTS.inc(page_type=page_type, result="miss" if cached is None else "hit")
+        if cached is not None:
+            return cached
+    if throttle is not None:
+        await throttle(url)
+    try:
+        with metrics.timer(FETCH_SECONDS, page_type=page_type):
+            page = await _client().async_scrape(ScrapeConfig(url, **BASE_CONFIG))
+    except ScrapflyScrapeError:
+        FETCH_ERRORS.inc(page_type=page_type)
+        raise
+    if CACHE is not None:
+        CACHE.set(_cache_key(url), page_type, page.context["url"], page.content)
+    return page
+
+async def _concurrent_scrape(urls: List[str], page_type: str):
+    """Like SCRAPFLY.concurrent_scrape but cached pages are yielded first without a fetch."""
+    from scrapfly import ScrapeConfig, ScrapflyScrapeError
+
+    to_fetch = {}
+    for url in urls:
+        cached = CACHE.get(_cache_key(url), page_type) if CACHE is not None else None
+        if CACHE is not None:
+            CACHE_REQUESTS.inc(page_type=page_type, result="miss" if cached is None else "hit")
+        if cached is not None:
+            yield url, cached
+        else:
+            to_fetch[_normalize_url(url)] = url
+    if not to_fetch:
+        return
+    started = time.perf_counter()
+    configs = [ScrapeConfig(url, **BASE_CONFIG) for url in to_fetch.values()]
+    async for result in _client().concurrent_scrape(configs):
+        if isinstance(result, ScrapflyScrapeError):
+            FETCH_ERRORS.inc(page_type=page_type)
+            fetched_url = result.api_response.config["url"]
+        else:
+            FETCH_SECONDS.observe(time.perf_counter() - started, page_type=page_type)
+            fetched_url = result.config["url"]
+            if CACHE is not None:
+                CACHE.set(_cache_key(fetched_url), page_type, result.context["url"], result.content)
+        yield to_fetch.get(_normalize_url(fetched_url), fetched_url), result
+
+class TokenBucket:
+    """Allows `rate` acquisitions per second on average with bursts of up to `capacity`."""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+class FetchScheduler:
+    """Concurrency cap, per-host rate limit and retries shared by a batch of fetches."""
+
+    def __init__(self, concurrency: int = 10, rate: float = 5.0, retries: int = 3, backoff: float = 1.0):
+        self.retries = retries
+        self.backoff = backoff
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._buckets = defaultdict(lambda: TokenBucket(rate))
+
+    async def _throttle(self, url: str):
+        await self._buckets[urlparse(url).netloc].acquire()
+
+    async def fetch(self, url: str, page_type: str):
+        from scrapfly import ScrapflyScrapeError
+
+        for attempt in range(self.retries + 1):
+            try:
+                async with self._semaphore:
+                    return await _scrape(url, page_type, throttle=self._throttle)
+            except ScrapflyScrapeError as e:
+                # a missing page or a blocked request fails the same way on every attempt
+                if attempt == self.retries or not e.is_retryable:
+                    raise
+                delay = self.backoff * 2 ** attempt
+                log.warning(f"failed to scrape {url} ({e.message}), retrying in {delay}s")
+                await asyncio.sleep(delay)
+
+def _total_pages(first_page, max_pages: Optional[int] = None) -> int:
+    """Number of search pages to fetch, read from the result count on the first page."""
     total_results = first_page.selector.css(".srp-controls__count-heading>span::text").get()
     total_results = int(total_results.replace(",", "").replace(".", ""))
     items_per_page = int(_get_url_parameter(first_page.context["url"], "_ipg", default=60))
     total_pages = math.ceil(total_results / items_per_page)
     if max_pages and total_pages > max_pages:
         total_pages = max_pages
-    other_pages = [
-        ScrapeConfig(_update_url_param(first_page.context["url"], _pgn=i), **BASE_CONFIG)
-        for i in range(2, total_pages + 1)
-    ]
+    return total_pages
+
+# eBay's largest page size, the same listings in a quarter of the fetches
+MAX_ITEMS_PER_PAGE = 240
+# _sop values of the "Price + Shipping: lowest first" and "highest first" sorts
+PRICE_SORTS = {"price_asc": "15", "price_desc": "16"}
+
+def plan_search(
+    url: str,
+    min_price: Optional[int] = None,
+    max_price: Optional[int] = None,
+    buy_it_now: bool = True,
+    sort: Optional[str] = None,
+    items_per_page: int = MAX_ITEMS_PER_PAGE,
+) -> str:
+    """Move the filters parse_search applies locally into the search URL."""
+    params = {"_ipg": items_per_page}
+    if min_price:
+        params["_udlo"] = int(min_price)
+    if max_price:
+        params["_udhi"] = int(max_price)
+    if buy_it_now:
+        params["LH_BIN"] = 1
+    if sort:
+        params["_sop"] = PRICE_SORTS[sort]
+    return _update_url_param(url, **params)
+
+def _price_sorted(url: str) -> bool:
+    return _get_url_parameter(url, "_sop") in PRICE_SORTS.values()
+
+def _can_stop(url: str, collected: int, limit: Optional[int]) -> bool:
+    """Whether a price sorted search already has the `limit` listings it needs."""
+    return _price_sorted(url) and bool(limit) and collected >= limit
+
+def parse_pool(processes: Optional[int] = None) -> ProcessPoolExecutor:
+    """Process pool to pass as `pool` to the scrape functions, so parsing runs on every core."""
+    # spawned rather than forked, the web app forks from a threaded process
+    return ProcessPoolExecutor(processes, mp_context=multiprocessing.get_context("spawn"))
+
+def _parse_search_html(url: str, html: str, start_index: int, min_price: int) -> List[Listing]:
+    return parse_search(CachedResponse(url, html), start_index, min_price)
+
+async def _parse_search_page(page, start_index: int, min_price: int, pool: Optional[Executor] = None) -> List[Listing]:
+    """parse_search on the event loop, or in `pool` with only the page's URL and HTML sent over."""
+    if pool is None:
+        return parse_search(page, start_index, min_price)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(pool, _parse_search_html, page.context["url"], page.content, start_index, min_price)
+
+async def iter_search(
+    url: str,
+    min_price: int,
+    max_pages: Optional[int] = None,
+    start_index: int = 1,
+    limit: Optional[int] = None,
+    wave: int = 4,
+    pool: Optional[Executor] = None,
+    failed_pages: Optional[List[str]] = None,
+) -> AsyncIterator[List[Listing]]:
+    """Scrape a search and yield each page's listings in page order as soon as they are parsed."""
+    from scrapfly import ScrapflyScrapeError
+
+    log.info("Scraping search for {}", url)
+    first_page = await _scrape(url, "search")
+    results = await _parse_search_page(first_page, start_index, min_price, pool)
+    yield results
+    collected = len(results)
+    if _can_stop(url, collected, limit):
+        return
+    total_pages = _total_pages(first_page, max_pages)
+    other_pages = [_update_url_param(first_page.context["url"], _pgn=i) for i in range(2, total_pages + 1)]
     log.info("Scraping search pagination of {} total pages for {}", len(other_pages), url)
+    # waves only pay off when the search can stop early, otherwise every page is fetched at once
+    if _price_sorted(url) and limit:
+        waves = [other_pages[i:i + wave] for i in range(0, len(other_pages), wave)]
+    else:
+        waves = [other_pages]
+    page_numbers = {page_url: number for number, page_url in enumerate(other_pages, 2)}
+    # page number -> its parse task (None when the fetch failed), drained in page order
+    parsing = {}
+    next_page = 2
     next_index = start_index + len(results)
-    async for result in SCRAPFLY.concurrent_scrape(other_pages):
-        if not isinstance(result, ScrapflyScrapeError):
+    try:
+        for number, pages in enumerate(waves):
+            async for page_url, result in _concurrent_scrape(pages, "search"):
+                if isinstance(result, ScrapflyScrapeError):
+                    log.error(f"failed to scrape {page_url}, got: {result.message}")
+                    if failed_pages is not None:
+                        failed_pages.append(page_url)
+                    parsing[page_numbers[page_url]] = None
+                else:
+                    # indexes depend on every earlier page, they are set once this page's turn comes
+                    parsing[page_numbers[page_url]] = asyncio.ensure_future(
+                        _parse_search_page(result, 0, min_price, pool)
+                    )
+                while next_page in parsing:
+                    task = parsing.pop(next_page)
+                    next_page += 1
+                    if task is None:
+                        continue
+                    try:
+                        results = await task
+                    except Exception as e:
+                        log.error(f"failed to parse search page {next_page - 1} of {url}: {e}")
+                        if failed_pages is not None:
+                            failed_pages.append(other_pages[next_page - 3])
+                        continue
+                    for listing in results:
+                        listing.index = next_index
+                        next_index += 1
+                    collected += len(results)
+                    yield results
+            if number + 1 < len(waves) and _can_stop(url, collected, limit):
+                skipped = sum(len(later) for later in waves[number + 1:])
+                log.info("Stopping search early, {} pages can't add listings to {}", skipped, url)
+                return
+    finally:
+        for task in parsing.values():
+            if task is not None:
+                task.cancel()
+
+async def scrape_search(
+    url: str,
+    min_price: int,
+    max_pages: Optional[int] = None,
+    start_index: int = 1,
+    limit: Optional[int] = None,
+    pool: Optional[Executor] = None,
+) -> List[Listing]:
+    results = []
+    async for page in iter_search(url, min_price, max_pages, start_index, limit, pool=pool):
+        results.extend(page)
+    return results
+
+async def scrape_searches(
+    searches: Dict[str, Optional[int]],
+    min_price: int,
+    speculative_pages: int = 3,
+    concurrency: int = 10,
+    rate: float = 10.0,
+    start_index: int = 1,
+    pool: Optional[Executor] = None,
+) -> Dict[str, List[Listing]]:
+    """Scrape several searches at once, `searches` maps each search URL to its max_pages."""
+    scheduler = FetchScheduler(concurrency=concurrency, rate=rate)
+    tasks = {}
+    # search URL -> page number -> parse task
+    parsing = defaultdict(dict)
+    total_pages = {}
+
+    def schedule(url: str, number: int):
+        page_url = url if number == 1 else _update_url_param(url, _pgn=number)
+        task = asyncio.create_task(scheduler.fetch(page_url, "search"))
+        tasks[task] = (url, number)
+        return task
+
+    def cancel_after(url: str, last_page: int):
+        for task, (task_url, number) in tasks.items():
+            if task_url == url and number > last_page:
+                task.cancel()
+
+    for url, max_pages in searches.items():
+        log.info("Scraping search for {}", url)
+        for number in range(1, min(speculative_pages, max_pages or speculative_pages) + 1):
+            schedule(url, number)
+
+    pending = set(tasks)
+    while pending:
+        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            url, number = tasks[task]
+            if task.cancelled():
+                continue
             try:
-                results.extend(parse_search(result, next_index, min_price))
-                next_index += len(results)
+                page = task.result()
             except Exception as e:
-                log.error(f"failed to parse search: {result.context['url']}: {e}")
-        else:
-            log.error(f"failed to scrape {result.api_response.config['url']}, got: {result.message}")
+                log.error(f"failed to scrape search page {number} of {url}: {e}")
+                if number == 1:
+                    total_pages[url] = 0
+                    cancel_after(url, 0)
+                continue
+            # not awaited here, with a pool every worker gets a page while the rest are fetched
+            parsing[url][number] = asyncio.ensure_future(_parse_search_page(page, start_index, min_price, pool))
+            if number == 1:
+                total_pages[url] = _total_pages(page, searches[url])
+                cancel_after(url, total_pages[url])
+                pending.update(schedule(url, later) for later in range(speculative_pages + 1, total_pages[url] + 1))
+
+    results = {}
+    for url in searches:
+        results[url] = []
+        for number, parse in sorted(parsing[url].items()):
+            if number > total_pages.get(url, 0):
+                parse.cancel()
+                continue
+            try:
+                results[url].extend(await parse)
+            except Exception as e:
+                log.error(f"failed to parse search page {number} of {url}: {e}")
+        for index, item in enumerate(results[url], start_index):
+            item.index = index
     return results
 
-def display_table(data: List[Dict]):
-    df = pd.DataFrame(data)
-    print(df)
+def display_table(data: List[Listing]):
+    print(listings_frame(data))
 
 # Example usage
 if __name__ == "__main__":
-    import asyncio
-
     if len(sys.argv) < 2:
         print("Usage: python script.py <min_price>")
         sys.exit(1)
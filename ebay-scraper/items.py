@@ -0,0 +1,144 @@
+"""Persistent index of every listing seen, keyed by eBay item id.
+
+Search runs are deduplicated into it as they are ingested, so an item keeps one
+row (and one id) across pages, keyword variants and runs. Enriched product pages
+are stored next to the listing. Lookups by id and by price range and condition
+go through SQLite indexes.
+"""
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Union
+
+import store
+from models import Listing, Product
+
+COLUMNS = ("id", "url", "title", "price", "condition", "location", "photo", "product", "first_seen", "last_seen")
+
+
+class ItemIndex:
+    """Latest listing details and enriched product of every item id."""
+
+    def __init__(self, path: Union[str, Path] = store.RESULTS_DIR / "items.sqlite"):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(str(path), check_same_thread=False)
+        self._lock = threading.Lock()
+        # searches write while the web app reads, WAL keeps readers from waiting on them
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS items ("
+            " id TEXT PRIMARY KEY, url TEXT, title TEXT, price INTEGER, condition TEXT, location TEXT,"
+            " photo TEXT, product TEXT, first_seen REAL, last_seen REAL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS items_price ON items (price)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS items_condition_price ON items (condition, price)")
+        self._db.commit()
+
+    def ingest(self, listings: Iterable[Listing], now: float = None) -> int:
+        """Insert or refresh the listings, duplicates within the batch are skipped. Returns how many ids were new."""
+        now = now or time.time()
+        rows = {}
+        for listing in listings:
+            if listing.id is not None and listing.id not in rows:
+                rows[listing.id] = (
+                    listing.id, listing.url, listing.title, listing.price, listing.condition,
+                    listing.location, listing.photo, now, now,
+                )
+        with self._lock:
+            before = self._db.total_changes
+            self._db.executemany(
+                "INSERT OR IGNORE INTO items (id, url, title, price, condition, location, photo, first_seen, last_seen)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                rows.values(),
+            )
+            new = self._db.total_changes - before
+            self._db.executemany(
+                "UPDATE items SET url = ?, title = ?, price = ?, condition = ?, location = ?, photo = ?, last_seen = ?"
+                " WHERE id = ?",
+                [(*row[1:7], now, row[0]) for row in rows.values()],
+            )
+            self._db.commit()
+        return new
+
+    def add_product(self, product: Product, now: float = None):
+        """Store a scrape_product result with its item, the item is created if no search listed it yet."""
+        now = now or time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO items (id, url, title, price, product, first_seen, last_seen) VALUES (?, ?, ?, ?, ?, ?, ?)"
+                " ON CONFLICT (id) DO UPDATE SET product = excluded.product, last_seen = excluded.last_seen",
+                (
+                    product.id, product.url, product.name, product.price_converted or product.price_original,
+                    json.dumps(product.to_dict()), now, now,
+                ),
+            )
+            self._db.commit()
+
+    def _rows(self, sql: str, params=()) -> List[Dict]:
+        with self._lock:
+            rows = self._db.execute(sql, params).fetchall()
+        items = [dict(zip(COLUMNS, row)) for row in rows]
+        for item in items:
+            if item["product"] is not None:
+                item["product"] = json.loads(item["product"])
+        return items
+
+    def get(self, id_: str) -> Optional[Dict]:
+        found = self._rows(f"SELECT {', '.join(COLUMNS)} FROM items WHERE id = ?", (id_,))
+        return found[0] if found else None
+
+    def get_many(self, ids: List[str]) -> List[Dict]:
+        """The items with these ids in the same order, unknown ids are left out."""
+        if not ids:
+            return []
+        found = self._rows(
+            f"SELECT {', '.join(COLUMNS)} FROM items WHERE id IN ({', '.join('?' * len(ids))})", tuple(ids)
+        )
+        by_id = {item["id"]: item for item in found}
+        return [by_id[id_] for id_ in ids if id_ in by_id]
+
+    def query(
+        self,
+        min_price: Optional[int] = None,
+        max_price: Optional[int] = None,
+        condition: Optional[str] = None,
+        limit: int = 100,
+    ) -> List[Dict]:
+        """Cheapest items first within the price range and, when given, with exactly this condition."""
+        where = ["price IS NOT NULL"]
+        params = []
+        if condition is not None:
+            where.append("condition = ?")
+            params.append(condition)
+        if min_price is not None:
+            where.append("price >= ?")
+            params.append(int(min_price))
+        if max_price is not None:
+            where.append("price <= ?")
+            params.append(int(max_price))
+        return self._rows(
+            f"SELECT {', '.join(COLUMNS)} FROM items WHERE {' AND '.join(where)} ORDER BY price LIMIT ?",
+            (*params, int(limit)),
+        )
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM items").fetchone()[0]
+
+
+_index = None
+
+
+def get_index() -> ItemIndex:
+    """The shared index, opened on first use."""
+    global _index
+    if _index is None:
+        _index = ItemIndex()
+    return _index
+
+
+def set_index(index: ItemIndex):
+    global _index
+    _index = index
@@ -0,0 +1,131 @@
+"""Counters and timers for the scrape -> parse -> store -> rank pipeline.
+
+Metrics are kept in process and rendered in the Prometheus text format by
+render(), which the Flask app serves on /metrics. Inside `with trace() as spans`
+every timer also appends a span, so one request can be broken down by stage.
+"""
+import functools
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Tuple
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+_current_trace: ContextVar[Optional[List[Dict]]] = ContextVar("trace", default=None)
+
+
+def _format_labels(labels: Tuple[Tuple[str, str], ...], extra: str = "") -> str:
+    parts = [f'{key}="{value}"' for key, value in labels]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Counter:
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(sorted((k, str(v)) for k, v in labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(tuple(sorted((k, str(v)) for k, v in labels.items())), 0)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(labels)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(sorted((k, str(v)) for k, v in labels.items()))
+        with self._lock:
+            counts, total, count = self._values.get(key, ([0] * len(self.buckets), 0.0, 0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._values[key] = (counts, total + value, count + 1)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for labels, (counts, total, count) in sorted(self._values.items()):
+                for bound, bucket_count in zip(self.buckets, counts):
+                    le = f'le="{bound}"'
+                    lines.append(f"{self.name}_bucket{_format_labels(labels, le)} {bucket_count}")
+                le = 'le="+Inf"'
+                lines.append(f"{self.name}_bucket{_format_labels(labels, le)} {count}")
+                lines.append(f"{self.name}_sum{_format_labels(labels)} {total}")
+                lines.append(f"{self.name}_count{_format_labels(labels)} {count}")
+        return lines
+
+
+_registry = {}
+_registry_lock = threading.Lock()
+
+
+def counter(name: str, help: str) -> Counter:
+    with _registry_lock:
+        return _registry.setdefault(name, Counter(name, help))
+
+
+def histogram(name: str, help: str, buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+    with _registry_lock:
+        return _registry.setdefault(name, Histogram(name, help, buckets))
+
+
+def render() -> str:
+    with _registry_lock:
+        metrics = list(_registry.values())
+    return "\n".join(line for metric in metrics for line in metric.render()) + "\n"
+
+
+@contextmanager
+def trace():
+    """Collect a span for every timer that runs inside the block (and in tasks started from it)."""
+    spans = []
+    token = _current_trace.set(spans)
+    try:
+        yield spans
+    finally:
+        _current_trace.reset(token)
+
+
+@contextmanager
+def timer(metric: Histogram, **labels):
+    """Observe how long the block took, only when it finishes without raising."""
+    started = time.perf_counter()
+    yield
+    elapsed = time.perf_counter() - started
+    metric.observe(elapsed, **labels)
+    spans = _current_trace.get()
+    if spans is not None:
+        spans.append({"name": metric.name, "labels": labels, "seconds": elapsed})
+
+
+def timed(metric: Histogram, **labels):
+    """Decorator version of timer() for plain functions."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with timer(metric, **labels):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,138 @@
+"""Compact records for parsed listings and products.
+
+Both classes use __slots__, so a listing costs a fixed handful of pointers
+instead of a dict with its own copy of every key. ListingColumns turns batches
+of listings straight into typed DataFrame columns.
+"""
+from operator import attrgetter
+from typing import TYPE_CHECKING, Dict, Iterable, List, Optional
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+
+class Listing:
+    """One search result, `id` is the eBay item id from the URL and `index` its position in the search."""
+
+    __slots__ = ("index", "id", "url", "title", "price", "location", "photo", "condition")
+
+    def __init__(
+        self,
+        index: int,
+        id: Optional[str],
+        url: Optional[str],
+        title: Optional[str],
+        price: Optional[int],
+        location: Optional[str],
+        photo: Optional[str],
+        condition: Optional[str],
+    ):
+        self.index = index
+        self.id = id
+        self.url = url
+        self.title = title
+        self.price = price
+        self.location = location
+        self.photo = photo
+        self.condition = condition
+
+    def to_dict(self) -> Dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __repr__(self):
+        return f"Listing({self.index}, {self.title!r}, price={self.price})"
+
+
+class Product:
+    """A scraped item page, description and variants are filled in after parsing."""
+
+    __slots__ = (
+        "url",
+        "id",
+        "price_original",
+        "price_converted",
+        "name",
+        "seller_name",
+        "seller_url",
+        "photos",
+        "description_url",
+        "features",
+        "description",
+        "variants",
+    )
+
+    def __init__(
+        self,
+        url: str,
+        id: str,
+        price_original: Optional[int],
+        price_converted: Optional[int],
+        name: str,
+        seller_name: str,
+        seller_url: str,
+        photos: List[str],
+        description_url: str,
+        features: Dict[str, str],
+        description: Optional[str] = None,
+        variants: Optional[List[Dict]] = None,
+    ):
+        self.url = url
+        self.id = id
+        self.price_original = price_original
+        self.price_converted = price_converted
+        self.name = name
+        self.seller_name = seller_name
+        self.seller_url = seller_url
+        self.photos = photos
+        self.description_url = description_url
+        self.features = features
+        self.description = description
+        self.variants = variants if variants is not None else []
+
+    def to_dict(self) -> Dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __repr__(self):
+        return f"Product({self.id!r}, {self.name!r}, price={self.price_converted or self.price_original})"
+
+
+class ListingColumns:
+    """Collects listings page by page as columns and builds the typed DataFrame once."""
+
+    _values = attrgetter(*Listing.__slots__)
+
+    def __init__(self):
+        self._columns = {name: [] for name in Listing.__slots__}
+
+    def extend(self, listings: Iterable[Listing]):
+        rows = list(map(self._values, listings))
+        if not rows:
+            return
+        for name, values in zip(Listing.__slots__, zip(*rows)):
+            self._columns[name].extend(values)
+
+    def __len__(self) -> int:
+        return len(self._columns["index"])
+
+    def to_frame(self) -> "pd.DataFrame":
+        import pandas as pd
+
+        columns = self._columns
+        return pd.DataFrame(
+            {
+                "index": pd.array(columns["index"], dtype="int64"),
+                "id": pd.array(columns["id"], dtype=object),
+                "url": pd.array(columns["url"], dtype=object),
+                "title": pd.array(columns["title"], dtype=object),
+                "price": pd.array(columns["price"], dtype="Int64"),
+                "location": pd.Categorical(columns["location"]),
+                "photo": pd.array(columns["photo"], dtype=object),
+                "condition": pd.Categorical(columns["condition"]),
+            }
+        )
+
+
+def listings_frame(listings: Iterable[Listing]) -> "pd.DataFrame":
+    columns = ListingColumns()
+    columns.extend(listings)
+    return columns.to_frame()
@@ -0,0 +1,131 @@
+"""Offline stand-in for ScrapflyClient that serves recorded pages.
+
+    import ebay, replay
+    ebay.SCRAPFLY = replay.ReplayClient(directory="fixtures", latency=0.2, error_rate=0.05)
+
+Pages are recorded with RecordingClient, which wraps a real ScrapflyClient and
+saves every page it fetches into the same directory layout.
+"""
+import asyncio
+import hashlib
+import json
+import random
+from pathlib import Path
+from typing import Dict, List, Optional, Union
+
+from scrapfly import ScrapeConfig, ScrapflyScrapeError
+
+from cache import CachedResponse
+from ebay import _normalize_url
+
+
+class ReplayError(ScrapflyScrapeError):
+    """A replayed scrape failure, raised and yielded wherever Scrapfly would."""
+
+    def __str__(self):
+        return self.message
+
+
+class ReplayClient:
+    """Answers async_scrape / concurrent_scrape from recorded HTML."""
+
+    def __init__(
+        self,
+        directory: Optional[Union[str, Path]] = None,
+        pages: Optional[Dict[str, str]] = None,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        error_rate: float = 0.0,
+        max_concurrency: int = 5,
+        seed: Optional[int] = None,
+    ):
+        self.directory = Path(directory) if directory else None
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.max_concurrency = max_concurrency
+        self.requests = 0
+        self.peak_concurrency = 0
+        self._in_flight = 0
+        self._pages = {}
+        self._random = random.Random(seed)
+        self._semaphore = None
+        if self.directory and (self.directory / "index.json").exists():
+            index = json.loads((self.directory / "index.json").read_text())
+            for url, filename in index.items():
+                self._pages[url] = (self.directory / filename).read_text(encoding="utf-8")
+        for url, html in (pages or {}).items():
+            self.add(url, html)
+
+    def add(self, url: str, html: str):
+        self._pages[_normalize_url(url)] = html
+
+    def save(self, url: str, html: str):
+        """Add a page and write it to the fixture directory."""
+        self.add(url, html)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        index_path = self.directory / "index.json"
+        index = json.loads(index_path.read_text()) if index_path.exists() else {}
+        url = _normalize_url(url)
+        filename = hashlib.sha1(url.encode("utf-8")).hexdigest() + ".html"
+        (self.directory / filename).write_text(html, encoding="utf-8")
+        index[url] = filename
+        index_path.write_text(json.dumps(index, indent=2, sort_keys=True))
+
+    def _error(self, url: str, message: str, status: int) -> ReplayError:
+        error = ReplayError(
+            request=None, response=None, message=message, code="ERR::REPLAY",
+            http_status_code=status, resource="SCRAPE", is_retryable=status >= 500,
+        )
+        # scrape_search logs the failed URL from the error's api_response
+        error.api_response = CachedResponse(url, "")
+        return error
+
+    async def async_scrape(self, scrape_config: ScrapeConfig) -> CachedResponse:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        url = scrape_config.url
+        async with self._semaphore:
+            self.requests += 1
+            self._in_flight += 1
+            self.peak_concurrency = max(self.peak_concurrency, self._in_flight)
+            try:
+                await asyncio.sleep(self.latency + self._random.uniform(0, self.jitter))
+            finally:
+                self._in_flight -= 1
+        if self._random.random() < self.error_rate:
+            raise self._error(url, "replayed upstream error", 502)
+        html = self._pages.get(_normalize_url(url))
+        if html is None:
+            raise self._error(url, f"no recorded page for {url}", 404)
+        return CachedResponse(url, html)
+
+    async def concurrent_scrape(self, scrape_configs: List[ScrapeConfig], concurrency: Optional[int] = None):
+        """Yields pages (or the ScrapflyScrapeError) in completion order, like ScrapflyClient."""
+        async def scrape(config):
+            try:
+                return await self.async_scrape(config)
+            except ScrapflyScrapeError as e:
+                return e
+
+        for task in asyncio.as_completed([scrape(config) for config in scrape_configs]):
+            yield await task
+
+
+class RecordingClient:
+    """Wraps a real ScrapflyClient and saves every fetched page for ReplayClient."""
+
+    def __init__(self, client, directory: Union[str, Path]):
+        self.client = client
+        self.replay = ReplayClient(directory)
+
+    async def async_scrape(self, scrape_config: ScrapeConfig):
+        response = await self.client.async_scrape(scrape_config)
+        self.replay.save(scrape_config.url, response.content)
+        return response
+
+    async def concurrent_scrape(self, scrape_configs: List[ScrapeConfig], concurrency: Optional[int] = None):
+        async for response in self.client.concurrent_scrape(scrape_configs, concurrency):
+            if not isinstance(response, ScrapflyScrapeError):
+                self.replay.save(response.config["url"], response.content)
+            yield response
@@ -1,11 +1,15 @@
 import asyncio
 import json
+import re
 from datetime import datetime
 from pathlib import Path
-import pandas as pd
-from openpyxl import load_workbook
-from openpyxl.worksheet.table import Table, TableStyleInfo
-from ebay import scrape_search, scrape_product  # Ensure ebay.py contains these functions
+from typing import Dict, List
+import ebay
+import items
+import store
+from cache import SQLiteCache
+from ebay import iter_search, plan_search, scrape_searches, scrape_product  # Ensure ebay.py contains these functions
+from models import Listing, ListingColumns, listings_frame
 import sys
 
 if __name__ == "__main__":
@@ -15,8 +19,7 @@ if __name__ == "__main__":
         print("You provided the argument:", argument1)
     else:
         print("No argument was provided.")
-output = Path(__file__).parent / "results"
-output.mkdir(exist_ok=True)
+output = store.RESULTS_DIR
 
 class DateTimeEncoder(json.JSONEncoder):
     """Custom JSONEncoder subclass that knows how to encode datetime values."""
@@ -25,76 +28,82 @@ class DateTimeEncoder(json.JSONEncoder):
             return o.isoformat()  # Convert datetime objects to ISO-8601 string format
         return super(DateTimeEncoder, self).default(o)  # Default behaviour for other types
 
-def convert_price_to_int(data):
-    """Convert price fields to integers if possible."""
-    for item in data:
-        if isinstance(item, dict):
-            for key in item.keys():
-                if 'price' in key and item[key] is not None:
-                    try:
-                        item[key] = int(float(item[key]))
-                    except ValueError:
-                        pass  # If conversion fails, keep the original value
-    return data
-
-def add_table_to_sheet(sheet, table_name):
-    """Add a table to the given sheet with a unique table name."""
-    table_range = f"A1:{chr(65 + sheet.max_column - 1)}{sheet.max_row}"
-    tab = Table(displayName=table_name, ref=table_range)
+def build_search_url(product: str, min_price=None, sort: str = None) -> str:
+    """Search URL with the price floor, Buy It Now only and the largest page size set (see ebay.plan_search)."""
+    search_url = "https://www.ebay.com/sch/i.html?_from=R40&_trksid=p4432023.m570.l1312&_nkw="
+    search_url += product
+    search_url += "&_sacat=0"
+    return plan_search(search_url, min_price=min_price, sort=sort)
 
-    style = TableStyleInfo(
-        name="TableStyleMedium9",
-        showFirstColumn=False,
-        showLastColumn=False,
-        showRowStripes=True,
-        showColumnStripes=True
+async def search_many(products: List[str], min_price, max_pages: int = 2, pool=None) -> Dict[str, List[Listing]]:
+    """Search several products in one concurrent batch, results are keyed by product."""
+    urls = {build_search_url(product, min_price): product for product in products}
+    results = await scrape_searches(
+        {url: max_pages for url in urls}, min_price, speculative_pages=max_pages, start_index=0, pool=pool
     )
-    tab.tableStyleInfo = style
-    sheet.add_table(tab)
-
-# Initialize a global index variable
-global_index = 0
+    return {urls[url]: listings for url, listings in results.items()}
 
-async def run():
-    global global_index  # Access the global index variable
+def unseen(listings: List[Listing], seen: set, start: int) -> List[Listing]:
+    """The listings whose item id isn't in `seen` yet, renumbered from `start`."""
+    fresh = []
+    for listing in listings:
+        if listing.id is None or listing.id not in seen:
+            seen.add(listing.id)
+            listing.index = start + len(fresh)
+            fresh.append(listing)
+    return fresh
 
+async def run(product: str, min_price, results_dir: Path = None, pool=None) -> Path:
+    """Scrape `product` and save the result tables, returns the directory they were saved to."""
     print("Running eBay.com scrape and saving results to ./results directory")
+    results_dir = results_dir or output / "latest"
 
-    search_url = "https://www.ebay.com/sch/i.html?_from=R40&_trksid=p4432023.m570.l1312&_nkw="
-    search_url += sys.argv[1]
-    search_url += "&_sacat=0"
-    search_results = await scrape_search(search_url, sys.argv[2], max_pages=2, start_index=global_index)
+    # listings go into typed columns page by page, prices are already ints from parsing
+    search_results = ListingColumns()
+    search_url = build_search_url(product, min_price)
+    item_index = items.get_index()
+    seen = set()
+    async for page in iter_search(search_url, min_price, max_pages=2, start_index=0, pool=pool):
+        item_index.ingest(page)
+        # pages shift while they're fetched, the same item can show up on two of them
+        search_results.extend(unseen(page, seen, len(search_results)))
+    store.save(results_dir, "search", search_results.to_frame())
 
-    # Update the global index after scraping
-    global_index += len(search_results)
+    # Scrape single product and add description
+    single_product_result = await scrape_product("https://www.ebay.com/itm/332562282948", min_price, pool=pool)
+    store.save(results_dir, "single_product", [single_product_result.to_dict()] if single_product_result else [])
 
-    # Convert search results to DataFrame and save as Excel
-    df_search = pd.DataFrame(search_results)
-    excel_path = output / "ebay_data.xlsx"
-    with pd.ExcelWriter(excel_path, engine='openpyxl') as excel_writer:
-        df_search.to_excel(excel_writer, sheet_name='Search Results', index=False)
-        
-        # Scrape single product and add description
-        single_product_result = await scrape_product("https://www.ebay.com/itm/332562282948", sys.argv[2])
-        single_product_result = convert_price_to_int([single_product_result])  # Convert prices to integers
-        df_single_product = pd.DataFrame(single_product_result)
-        df_single_product.to_excel(excel_writer, sheet_name='Single Product', index=False)
+    # Scrape product variants and add descriptions
+    variant_product_result = await scrape_product("https://www.ebay.com/itm/393531906094", min_price, pool=pool)
+    store.save(results_dir, "variant_product", [variant_product_result.to_dict()] if variant_product_result else [])
+    for product_result in (single_product_result, variant_product_result):
+        if product_result is not None:
+            item_index.add_product(product_result)
+    return results_dir
 
-        # Scrape product variants and add descriptions
-        variant_product_result = await scrape_product("https://www.ebay.com/itm/393531906094", sys.argv[2])
-        if isinstance(variant_product_result, dict):
-            variant_product_result = [variant_product_result]
-        variant_product_result = convert_price_to_int(variant_product_result)  # Convert prices to integers
-        df_variant_product = pd.DataFrame(variant_product_result)
-        df_variant_product.to_excel(excel_writer, sheet_name='Product Variants', index=False)
-
-    # Load the workbook and add tables
-    workbook = load_workbook(excel_path)
-    for sheet_name in workbook.sheetnames:
-        sheet = workbook[sheet_name]
-        table_name = f"Table_{sheet_name.replace(' ', '_')}"
-        add_table_to_sheet(sheet, table_name)
-    workbook.save(excel_path)
+async def compare(products: List[str], min_price, results_dir: Path = None, pool=None) -> Dict[str, Path]:
+    """Search every product in one batch (see search_many) and save each one's search table in its own directory."""
+    results_dir = results_dir or output / "latest"
+    item_index = items.get_index()
+    saved = {}
+    for product, listings in (await search_many(products, min_price, pool=pool)).items():
+        item_index.ingest(listings)
+        saved[product] = results_dir / (re.sub(r"[^a-z0-9]+", "-", product.lower()).strip("-") or "search")
+        store.save(saved[product], "search", listings_frame(unseen(listings, set(), 0)))
+    return saved
 
 if __name__ == "__main__":
-    asyncio.run(run())
+    # keep fetched pages on disk so repeated runs don't pay for the same pages again
+    ebay.CACHE = SQLiteCache(output / "cache.sqlite")
+    # --processes parses pages on every core, worth it for big multi-page searches
+    pool = ebay.parse_pool() if "--processes" in sys.argv else None
+    # "iphone 13,iphone 13 pro" compares several products, their searches run as one batch
+    products = [product.strip() for product in sys.argv[1].split(",") if product.strip()]
+    if len(products) > 1:
+        results_dirs = list(asyncio.run(compare(products, sys.argv[2], pool=pool)).values())
+    else:
+        results_dirs = [asyncio.run(run(sys.argv[1], sys.argv[2], pool=pool))]
+    if "--excel" in sys.argv:
+        for results_dir in results_dirs:
+            print("Saved workbook to", store.export_excel(results_dir))
+    print("Page cache:", ebay.CACHE.stats())
@@ -0,0 +1,106 @@
+import json
+from pathlib import Path
+from typing import TYPE_CHECKING, Dict, List, Sequence, Union
+
+import metrics
+
+# pandas and pyarrow are imported where they're used, importing store (for RESULTS_DIR) stays cheap
+if TYPE_CHECKING:
+    import pandas as pd
+    import pyarrow as pa
+
+RESULTS_DIR = Path(__file__).parent / "results"
+# Table name -> sheet name used when exporting to Excel
+TABLES = {
+    "search": "Search Results",
+    "single_product": "Single Product",
+    "variant_product": "Product Variants",
+}
+WRITE_SECONDS = metrics.histogram("ebayfinder_store_write_seconds", "Time to write one result table or Excel export")
+
+
+def _table_path(results_dir: Union[str, Path], name: str) -> Path:
+    return Path(results_dir) / f"{name}.arrow"
+
+
+def _to_arrow(records: Union[List[Dict], "pd.DataFrame"]) -> "pa.Table":
+    import pandas as pd
+    import pyarrow as pa
+
+    df = records if isinstance(records, pd.DataFrame) else pd.DataFrame(records)
+    # photos, features and variants don't have a fixed shape, keep them as JSON text
+    for column in df.columns:
+        if df[column].dtype == object and df[column].map(lambda value: isinstance(value, (dict, list))).any():
+            df[column] = df[column].map(lambda value: json.dumps(value) if isinstance(value, (dict, list)) else value)
+    return pa.Table.from_pandas(df, preserve_index=False)
+
+
+def save(results_dir: Union[str, Path], name: str, records: Union[List[Dict], "pd.DataFrame"]) -> Path:
+    """Write one result table as an uncompressed Arrow IPC (Feather v2) file."""
+    import pyarrow.feather as feather
+
+    path = _table_path(results_dir, name)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # uncompressed so the file can be memory mapped and read without copies
+    with metrics.timer(WRITE_SECONDS, table=name):
+        feather.write_feather(_to_arrow(records), str(path), compression="uncompressed")
+    return path
+
+
+def open_table(results_dir: Union[str, Path], name: str) -> "pa.Table":
+    """Memory map a result table, rows are only paged in when they are touched."""
+    import pyarrow.feather as feather
+
+    return feather.read_table(str(_table_path(results_dir, name)), memory_map=True)
+
+
+def take(results_dir: Union[str, Path], name: str, indices: Sequence[int]) -> List[Dict]:
+    """Return the rows at the given positions without reading the rest of the table."""
+    import pyarrow as pa
+
+    table = open_table(results_dir, name)
+    return table.take(pa.array(indices, type=pa.int64())).to_pylist()
+
+
+def load(results_dir: Union[str, Path], name: str) -> "pd.DataFrame":
+    return open_table(results_dir, name).to_pandas()
+
+
+def add_table_to_sheet(sheet, table_name):
+    """Add a table to the given sheet with a unique table name."""
+    from openpyxl.worksheet.table import Table, TableStyleInfo
+
+    table_range = f"A1:{chr(65 + sheet.max_column - 1)}{sheet.max_row}"
+    tab = Table(displayName=table_name, ref=table_range)
+
+    style = TableStyleInfo(
+        name="TableStyleMedium9",
+        showFirstColumn=False,
+        showLastColumn=False,
+        showRowStripes=True,
+        showColumnStripes=True
+    )
+    tab.tableStyleInfo = style
+    sheet.add_table(tab)
+
+
+def export_excel(results_dir: Union[str, Path], excel_path: Union[str, Path] = None) -> Path:
+    """Build the old Excel workbook from the stored tables, only done on demand."""
+    import pandas as pd
+    from openpyxl import load_workbook
+
+    excel_path = Path(excel_path or Path(results_dir) / "ebay_data.xlsx")
+    with metrics.timer(WRITE_SECONDS, table="excel"):
+        with pd.ExcelWriter(excel_path, engine='openpyxl') as excel_writer:
+            for name, sheet_name in TABLES.items():
+                if _table_path(results_dir, name).exists():
+                    load(results_dir, name).to_excel(excel_writer, sheet_name=sheet_name, index=False)
+
+        # Load the workbook and add tables
+        workbook = load_workbook(excel_path)
+        for sheet_name in workbook.sheetnames:
+            sheet = workbook[sheet_name]
+            table_name = f"Table_{sheet_name.replace(' ', '_')}"
+            add_table_to_sheet(sheet, table_name)
+        workbook.save(excel_path)
+    return excel_path
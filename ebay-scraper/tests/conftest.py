@@ -0,0 +1,7 @@
+import os
+import sys
+
+# the scraper modules live one level up from the tests, the web app's next to them in Flask/
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "Flask"))
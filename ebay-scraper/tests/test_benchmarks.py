@@ -0,0 +1,62 @@
+"""Parse and search benchmarks, run with python -m pytest --benchmark-only (needs pytest-benchmark)."""
+import asyncio
+import tracemalloc
+
+import pytest
+
+pytest.importorskip("pytest_benchmark")
+
+import ebay
+from bench import PAGE_COUNTS, SEARCH_URL, synthetic_product_page, synthetic_search_page
+from cache import CachedResponse
+from ebay import _update_url_param, parse_product, parse_search, parse_variants, scrape_search
+from replay import ReplayClient
+
+
+@pytest.fixture(scope="module")
+def search_pages():
+    pages = {SEARCH_URL: synthetic_search_page(0)}
+    for page in range(2, max(PAGE_COUNTS) + 1):
+        pages[_update_url_param(SEARCH_URL, _pgn=page)] = synthetic_search_page(page - 1)
+    return pages
+
+
+@pytest.mark.parametrize("items", [60, 240])
+def test_parse_search(benchmark, items):
+    html = synthetic_search_page(0, items)
+    listings = benchmark(lambda: parse_search(CachedResponse(SEARCH_URL, html)))
+    assert listings
+
+
+def test_parse_product(benchmark):
+    html = synthetic_product_page()
+    product = benchmark(lambda: parse_product(CachedResponse(SEARCH_URL, html), 1))
+    assert product.name == "Bench Phone"
+
+
+def test_parse_variants(benchmark):
+    html = synthetic_product_page()
+    assert benchmark(lambda: parse_variants(CachedResponse(SEARCH_URL, html)))
+
+
+@pytest.mark.parametrize("page_count", PAGE_COUNTS)
+def test_search_throughput(benchmark, monkeypatch, search_pages, page_count):
+    monkeypatch.setattr(ebay, "CACHE", None)
+
+    def setup():
+        # a fresh client each round, so nothing is shared between runs
+        monkeypatch.setattr(ebay, "SCRAPFLY", ReplayClient(pages=search_pages, latency=0.01, max_concurrency=5, seed=1))
+
+    def search():
+        return asyncio.run(scrape_search(SEARCH_URL, 1, max_pages=page_count))
+
+    listings = benchmark.pedantic(search, setup=setup, rounds=3)
+    assert len(listings) >= 51 * page_count
+
+    setup()
+    tracemalloc.start()
+    search()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    benchmark.extra_info["listings"] = len(listings)
+    benchmark.extra_info["peak_memory_mb"] = peak / 1024 / 1024
@@ -0,0 +1,94 @@
+import json
+
+import pytest
+
+import finresult
+from finresult import RankingError, StubBackend, ask_for_ranking, parse_ranking
+
+CANDIDATES = {3, 7, 11, 12, 20, 31, 40}
+
+
+def reply(best_deal, recommendations, summary="cheapest working one"):
+    return json.dumps({"best_deal": best_deal, "recommendations": recommendations, "summary": summary})
+
+
+class ReplyBackend:
+    """Gives the replies in order, one per model call."""
+
+    def __init__(self, *replies):
+        self.replies = list(replies)
+        self.prompts = []
+
+    def generate(self, prompt_parts):
+        self.prompts.append(prompt_parts)
+        return self.replies.pop(0)
+
+
+@pytest.fixture
+def backend():
+    def use(backend):
+        finresult.set_backend(backend)
+        return backend
+    yield use
+    finresult.set_backend(None)
+
+
+def test_parse_ranking():
+    ranking = parse_ranking(reply(7, [3, 11, 12, 20, 31]), CANDIDATES)
+    assert ranking.indices == [7, 3, 11, 12, 20, 31]
+    assert ranking.summary == "cheapest working one"
+
+
+def test_parse_ranking_keeps_only_the_first_recommendations():
+    assert parse_ranking(reply(7, [3, 11, 12, 20, 31, 40]), CANDIDATES).recommendations == [3, 11, 12, 20, 31]
+
+
+def test_parse_ranking_with_few_candidates():
+    assert parse_ranking(reply(7, [3]), {3, 7}).indices == [7, 3]
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        "001, 045, 078",
+        "[7, 3]",
+        reply(7, "3, 11"),
+        reply("7", [3, 11, 12, 20, 31]),
+        reply(True, [3, 11, 12, 20, 31]),
+        reply(8, [3, 11, 12, 20, 31]),
+        reply(7, [3, 11, 11, 20, 31]),
+        reply(7, [7, 3, 11, 12, 20]),
+        reply(7, [3, 11]),
+    ],
+)
+def test_parse_ranking_rejects(text):
+    with pytest.raises(RankingError):
+        parse_ranking(text, CANDIDATES)
+
+
+def test_ask_for_ranking(backend):
+    stub = backend(StubBackend(reply(7, [3, 11, 12, 20, 31])))
+    assert ask_for_ranking(["prompt"], CANDIDATES).best_deal == 7
+    assert stub.calls == 1
+
+
+def test_ask_for_ranking_asks_again_with_the_error(backend):
+    replies = backend(ReplyBackend(reply(7, [7, 3, 11, 12, 20]), reply(7, [3, 11, 12, 20, 31])))
+    assert ask_for_ranking(["prompt"], CANDIDATES).indices == [7, 3, 11, 12, 20, 31]
+    retry = replies.prompts[1]
+    assert retry[:2] == ["prompt", reply(7, [7, 3, 11, 12, 20])]
+    assert "repeated" in retry[2]
+
+
+def test_ask_for_ranking_gives_up_after_one_retry(backend):
+    backend(ReplyBackend("not json", "still not json", reply(7, [3, 11, 12, 20, 31])))
+    with pytest.raises(RankingError):
+        ask_for_ranking(["prompt"], CANDIDATES)
+
+
+def test_example_answers_follow_the_schema():
+    answers = finresult.EXAMPLE_PARTS[1::2]
+    for answer in answers:
+        data = json.loads(answer)
+        assert set(data) == set(finresult.RANKING_SCHEMA["properties"])
+        assert len(data["recommendations"]) == finresult.RECOMMENDATIONS
@@ -0,0 +1,38 @@
+import time
+
+from jobs import JobRunner
+
+
+async def finish(value):
+    return value
+
+
+def wait_done(runner, jobs, timeout=5):
+    deadline = time.time() + timeout
+    while not all(job.done for job in jobs) and time.time() < deadline:
+        time.sleep(0.01)
+
+
+def test_evicted_jobs_are_handed_to_on_evict():
+    evicted = []
+    runner = JobRunner(max_concurrent=1, max_history=2, on_evict=evicted.append)
+    jobs = []
+    for i in range(4):
+        jobs.append(runner.submit(f"job {i}", finish, i))
+        wait_done(runner, jobs)
+    # eviction happens on submit, the 4th submit sees three finished jobs and keeps the last two
+    assert [job.id for job in evicted] == [jobs[0].id]
+    assert runner.get(jobs[0].id) is None
+    assert runner.get(jobs[3].id).result == 3
+
+
+def test_on_evict_errors_do_not_fail_submit():
+    def fail(job):
+        raise OSError("busy")
+
+    runner = JobRunner(max_history=0, on_evict=fail)
+    first = runner.submit("first", finish, 1)
+    wait_done(runner, [first])
+    second = runner.submit("second", finish, 2)
+    wait_done(runner, [second])
+    assert second.result == 2
@@ -0,0 +1,56 @@
+"""Parser output on saved pages, compared with what the original parsel-based parsers returned.
+
+The expected dicts in fixtures/*.json were produced by the parsers before they
+moved to compiled selectors, so any difference is a parsing regression.
+"""
+import json
+from pathlib import Path
+
+import ebay
+from cache import CachedResponse
+
+FIXTURES = Path(__file__).parent / "fixtures"
+SEARCH_URL = "https://www.ebay.com/sch/i.html?_nkw=meta+quest+3"
+PRODUCT_URL = "https://www.ebay.com/itm/404875432190"
+
+
+def page(name: str, url: str) -> CachedResponse:
+    return CachedResponse(url, (FIXTURES / f"{name}.html").read_text(encoding="utf-8"))
+
+
+def expected(name: str):
+    return json.loads((FIXTURES / f"{name}.json").read_text(encoding="utf-8"))
+
+
+def test_parse_search():
+    listings = ebay.parse_search(page("search", SEARCH_URL), start_index=1, min_price=100)
+    assert [listing.to_dict() for listing in listings] == expected("search")
+
+
+def test_parse_search_in_pool_worker():
+    # what a parse_pool worker runs, only the URL and HTML are sent over
+    html = (FIXTURES / "search.html").read_text(encoding="utf-8")
+    listings = ebay._parse_search_html(SEARCH_URL, html, 1, 100)
+    assert [listing.to_dict() for listing in listings] == expected("search")
+
+
+def test_parse_product():
+    product = ebay.parse_product(page("product", PRODUCT_URL), min_price=100)
+    assert product.to_dict() == expected("product")
+
+
+def test_parse_product_id_matches_search_ids():
+    # canonical links can carry the title slug, the id has to be the one search listings get
+    html = (FIXTURES / "product.html").read_text(encoding="utf-8").replace(
+        '"https://www.ebay.com/itm/404875432190"', '"https://www.ebay.com/itm/Meta-Quest-3-VR-Headset/404875432190"'
+    )
+    product = ebay.parse_product(CachedResponse(PRODUCT_URL, html), min_price=100)
+    assert product.id == "404875432190"
+
+
+def test_parse_product_below_min_price():
+    assert ebay.parse_product(page("product", PRODUCT_URL), min_price=400) is None
+
+
+def test_parse_variants():
+    assert ebay.parse_variants(page("product", PRODUCT_URL)) == expected("variants")
@@ -0,0 +1,49 @@
+import pandas as pd
+
+from prerank import is_accessory_title, prerank
+
+
+def listings(rows):
+    return pd.DataFrame(
+        [{"index": i, "title": title, "price": price, "condition": "Used"} for i, (title, price) in enumerate(rows)]
+    )
+
+
+def test_bundles_are_kept():
+    df = listings([
+        ("Apple TV 4K 64GB with Siri Remote", 119),
+        ("Apple TV 4K 128GB Wi-Fi + Ethernet", 139),
+        ("Apple TV 4K 32GB", 95),
+        ("Siri Remote for Apple TV 4K", 25),
+        ("Apple TV 4K remote only", 19),
+    ])
+    titles = list(prerank(df, "apple tv 4k")["title"])
+    assert titles == ["Apple TV 4K 32GB", "Apple TV 4K 64GB with Siri Remote", "Apple TV 4K 128GB Wi-Fi + Ethernet"]
+
+
+def test_bundle_titles_are_not_accessories():
+    assert not is_accessory_title("MacBook Pro 13 M1 8GB 256GB Space Gray with Charger")
+    assert not is_accessory_title("Nintendo Switch OLED with Dock")
+    assert not is_accessory_title("Nintendo Switch OLED w/ Dock and Joy-Cons")
+    assert is_accessory_title("Hard Case for MacBook Pro 13")
+    assert is_accessory_title("Nintendo Switch Dock Only")
+
+
+def test_accessories_priced_like_the_product_are_kept():
+    df = listings([
+        ("Nintendo Switch OLED with Dock", 260),
+        ("Nintendo Switch OLED White", 280),
+        ("Nintendo Switch OLED Console", 270),
+        ("Nintendo Switch OLED dock and case bundle", 275),
+        ("Nintendo Switch OLED dock only", 45),
+    ])
+    titles = set(prerank(df, "nintendo switch oled")["title"])
+    assert "Nintendo Switch OLED with Dock" in titles
+    assert "Nintendo Switch OLED dock and case bundle" in titles
+    assert "Nintendo Switch OLED dock only" not in titles
+
+
+def test_index_column_is_kept():
+    df = listings([("MacBook Pro 13 M1 with Charger", 650), ("MacBook Pro 13 M1", 600), ("Charger for MacBook Pro 13", 30)])
+    df["index"] = [7, 3, 9]
+    assert list(prerank(df, "macbook pro 13 m1")["index"]) == [3, 7]
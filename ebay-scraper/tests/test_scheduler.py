@@ -0,0 +1,32 @@
+import asyncio
+
+import pytest
+
+import ebay
+from replay import ReplayClient, ReplayError
+
+URL = "https://www.ebay.com/itm/404875432190"
+
+
+@pytest.fixture
+def replay(monkeypatch):
+    def use(client):
+        monkeypatch.setattr(ebay, "SCRAPFLY", client)
+        return client
+    monkeypatch.setattr(ebay, "CACHE", None)
+    return use
+
+
+def test_retryable_errors_are_retried(replay):
+    client = replay(ReplayClient(pages={URL: "<html></html>"}, error_rate=1.0))
+    with pytest.raises(ReplayError):
+        asyncio.run(ebay.FetchScheduler(retries=2, backoff=0.01).fetch(URL, "product"))
+    assert client.requests == 3
+
+
+def test_missing_pages_are_not_retried(replay):
+    client = replay(ReplayClient(pages={}))
+    with pytest.raises(ReplayError) as error:
+        asyncio.run(ebay.FetchScheduler(retries=2, backoff=0.01).fetch(URL, "product"))
+    assert error.value.http_status_code == 404
+    assert client.requests == 1
@@ -0,0 +1,113 @@
+"""iter_search and scrape_searches against replayed pages, see replay.ReplayClient."""
+import asyncio
+import time
+
+import pytest
+
+import ebay
+from bench import synthetic_search_page
+from ebay import _update_url_param, iter_search, plan_search, scrape_searches
+from replay import ReplayClient
+
+SEARCH_URL = "https://www.ebay.com/sch/i.html?_nkw=replay&_ipg=60"
+
+
+class DelayedClient(ReplayClient):
+    """A ReplayClient where each URL takes its own extra `delays[url]` seconds."""
+
+    def __init__(self, pages, delays):
+        super().__init__(pages=pages, max_concurrency=20)
+        self.delays = delays
+
+    async def async_scrape(self, scrape_config):
+        await asyncio.sleep(self.delays.get(scrape_config.url, 0))
+        return await super().async_scrape(scrape_config)
+
+
+def page_url(url, number):
+    return url if number == 1 else _update_url_param(url, _pgn=number)
+
+
+def search_pages(url, count, total_results=3000):
+    return {page_url(url, number): synthetic_search_page(number - 1, total_results=total_results) for number in range(1, count + 1)}
+
+
+@pytest.fixture
+def replay(monkeypatch):
+    def use(client):
+        monkeypatch.setattr(ebay, "SCRAPFLY", client)
+        return client
+    monkeypatch.setattr(ebay, "CACHE", None)
+    return use
+
+
+def page_number(listing):
+    # synthetic item ids are 100000 plus the listing's position in the whole search
+    return (int(listing.id) - 100000) // 60
+
+
+def collect(url, **kwargs):
+    async def run():
+        return [page async for page in iter_search(url, 1, **kwargs)]
+    return asyncio.run(run())
+
+
+def test_iter_search_yields_pages_in_order(replay):
+    # later pages come back first
+    delays = {page_url(SEARCH_URL, number): 0.05 / number for number in range(2, 6)}
+    replay(DelayedClient(search_pages(SEARCH_URL, 5), delays))
+    pages = collect(SEARCH_URL, max_pages=5, start_index=0)
+    numbers = [page_number(page[0]) for page in pages]
+    assert numbers == [0, 1, 2, 3, 4]
+    listings = [listing for page in pages for listing in page]
+    assert [listing.index for listing in listings] == list(range(len(listings)))
+
+
+def test_iter_search_reports_failed_pages(replay):
+    pages = search_pages(SEARCH_URL, 4)
+    del pages[page_url(SEARCH_URL, 3)]
+    replay(ReplayClient(pages=pages))
+    failed_pages = []
+    listings = [listing for page in collect(SEARCH_URL, max_pages=4, failed_pages=failed_pages) for listing in page]
+    assert failed_pages == [page_url(SEARCH_URL, 3)]
+    assert {page_number(listing) for listing in listings} == {0, 1, 3}
+    assert [listing.index for listing in listings] == list(range(1, len(listings) + 1))
+
+
+def test_price_sorted_search_stops_at_limit(replay):
+    url = plan_search(SEARCH_URL, 1, sort="price_asc", items_per_page=60)
+    client = replay(ReplayClient(pages=search_pages(url, 10)))
+    listings = [listing for page in collect(url, max_pages=10, limit=60, wave=2) for listing in page]
+    # 51 listings on the first page, the first wave of two pages gets past the limit
+    assert client.requests == 3
+    assert len(listings) >= 60
+
+
+def test_search_without_limit_fetches_every_page(replay):
+    url = plan_search(SEARCH_URL, 1, sort="price_asc", items_per_page=60)
+    client = replay(ReplayClient(pages=search_pages(url, 10)))
+    collect(url, max_pages=10, wave=2)
+    assert client.requests == 10
+
+
+def test_scrape_searches_cancels_pages_past_the_last(replay):
+    # the first page says there is only one page, the speculative ones never finish
+    pages = search_pages(SEARCH_URL, 1, total_results=60)
+    client = replay(DelayedClient(pages, {page_url(SEARCH_URL, number): 5 for number in (2, 3)}))
+    started = time.perf_counter()
+    results = asyncio.run(scrape_searches({SEARCH_URL: None}, 1, speculative_pages=3))
+    assert time.perf_counter() - started < 2
+    assert client.requests == 1
+    assert [listing.index for listing in results[SEARCH_URL]] == list(range(1, len(results[SEARCH_URL]) + 1))
+
+
+def test_scrape_searches_gives_up_on_a_missing_first_page(replay):
+    other_url = _update_url_param(SEARCH_URL, _nkw="other")
+    pages = search_pages(other_url, 2)
+    client = replay(DelayedClient(pages, {page_url(SEARCH_URL, number): 5 for number in (2, 3)}))
+    started = time.perf_counter()
+    results = asyncio.run(scrape_searches({SEARCH_URL: 3, other_url: 2}, 1, speculative_pages=3))
+    assert time.perf_counter() - started < 2
+    assert results[SEARCH_URL] == []
+    assert len(results[other_url]) > 0
+    assert client.requests == 3
@@ -0,0 +1,55 @@
+import pytest
+
+from models import Listing
+from watch import PriceIndex
+
+
+def listing(id_, price, condition="Used"):
+    return Listing(0, id_, f"https://www.ebay.com/itm/{id_}", f"Item {id_}", price, "US", None, condition)
+
+
+@pytest.fixture
+def index(tmp_path):
+    index = PriceIndex(tmp_path / "watch.sqlite")
+    index.diff("q", [listing("1", 100), listing("2", 150), listing("3", 200)], now=1)
+    return index
+
+
+def changes(found):
+    return sorted((change["id"], change["change"]) for change in found)
+
+
+def test_first_cycle_is_all_new(tmp_path):
+    found = PriceIndex(tmp_path / "watch.sqlite").diff("q", [listing("1", 100), listing("1", 100)])
+    assert changes(found) == [("1", "new")]
+
+
+def test_new_repriced_and_removed(index):
+    found = index.diff("q", [listing("1", 100), listing("2", 140), listing("4", 120)], now=2)
+    assert changes(found) == [("2", "repriced"), ("3", "removed"), ("4", "new")]
+    assert next(change for change in found if change["id"] == "2")["previous_price"] == 150
+    # removed listings are forgotten, the next cycle has nothing left to report
+    assert index.diff("q", [listing("1", 100), listing("2", 140), listing("4", 120)], now=3) == []
+
+
+def test_condition_change_counts_as_repriced(index):
+    found = index.diff("q", [listing("1", 100, "New"), listing("2", 150), listing("3", 200)], now=2)
+    assert changes(found) == [("1", "repriced")]
+
+
+def test_incomplete_cycle_removes_nothing(index):
+    found = index.diff("q", [listing("1", 100)], now=2, complete=False)
+    assert found == []
+    # the missing listings were kept, they are back without being reported new
+    assert index.diff("q", [listing("1", 100), listing("2", 150), listing("3", 200)], now=3) == []
+
+
+def test_listings_past_the_window_are_not_removed(index):
+    found = index.diff("q", [listing("1", 100), listing("5", 110)], now=2, max_price=160)
+    assert changes(found) == [("2", "removed"), ("5", "new")]
+    assert index.diff("q", [listing("1", 100), listing("5", 110), listing("3", 200)], now=3) == []
+
+
+def test_queries_are_separate(index):
+    assert changes(index.diff("other", [listing("1", 100)], now=2)) == [("1", "new")]
+    assert index.diff("q", [listing("1", 100), listing("2", 150), listing("3", 200)], now=3) == []
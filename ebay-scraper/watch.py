@@ -0,0 +1,175 @@
+"""Price-watch mode: re-run saved searches and report only what changed.
+
+Usage:
+    python watch.py <product> <min_price> [interval_seconds]
+    python watch.py <queries.json>
+
+queries.json holds a list of {"product", "min_price", "interval", "max_pages", "limit"} objects.
+Each query watches its `limit` cheapest Buy It Now listings.
+"""
+import asyncio
+import json
+import sqlite3
+import sys
+import time
+from pathlib import Path
+from typing import AsyncIterator, Dict, List, Optional, Tuple, Union
+
+from loguru import logger as log
+
+import ebay
+import store
+from ebay import item_id, iter_search, scrape_products
+from models import Listing
+from run import build_search_url
+
+
+class SavedQuery:
+    """A search for the `limit` cheapest listings that is re-checked every `interval` seconds."""
+
+    def __init__(self, product: str, min_price: int = 1, interval: int = 3600, max_pages: int = 2, limit: int = 200):
+        self.product = product
+        self.min_price = int(min_price)
+        self.interval = interval
+        self.max_pages = max_pages
+        self.limit = limit
+
+    @property
+    def key(self) -> str:
+        return f"{self.product}|{self.min_price}"
+
+    def __repr__(self):
+        return f"SavedQuery({self.product!r}, min_price={self.min_price})"
+
+
+class PriceIndex:
+    """Last known price and condition of every listing seen by each saved query."""
+
+    def __init__(self, path: Union[str, Path] = store.RESULTS_DIR / "watch.sqlite"):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(str(path), check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS watch_listings ("
+            " query TEXT, id TEXT, price INTEGER, condition TEXT, title TEXT, url TEXT,"
+            " first_seen REAL, last_seen REAL, PRIMARY KEY (query, id))"
+        )
+        self._db.commit()
+
+    def diff(
+        self, query: str, listings: List[Listing], now: float = None, complete: bool = True, max_price: Optional[int] = None
+    ) -> List[Dict]:
+        """Update the index with one cycle's listings and return the new, repriced and removed ones."""
+        now = now or time.time()
+        known = {
+            row[0]: row[1:]
+            for row in self._db.execute(
+                "SELECT id, price, condition, title, url FROM watch_listings WHERE query = ?", (query,)
+            )
+        }
+        changes = []
+        seen = set()
+        for listing in listings:
+            id_ = listing.id
+            if id_ is None or id_ in seen:
+                continue
+            seen.add(id_)
+            previous = known.get(id_)
+            if previous is None:
+                changes.append({**listing.to_dict(), "id": id_, "change": "new"})
+            elif (listing.price, listing.condition) != previous[:2]:
+                changes.append({**listing.to_dict(), "id": id_, "change": "repriced", "previous_price": previous[0]})
+            self._db.execute(
+                "INSERT INTO watch_listings VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+                " ON CONFLICT (query, id) DO UPDATE SET"
+                " price = excluded.price, condition = excluded.condition, title = excluded.title,"
+                " url = excluded.url, last_seen = excluded.last_seen",
+                (query, id_, listing.price, listing.condition, listing.title, listing.url, now, now),
+            )
+        # a cycle with failed pages can't tell a removed listing from one on a missing page
+        for id_ in known.keys() - seen if complete else ():
+            price, condition, title, url = known[id_]
+            # past the cheapest listings fetched, it may just have been pushed out of the window
+            if max_price is not None and (price is None or price > max_price):
+                continue
+            changes.append(
+                {"id": id_, "url": url, "title": title, "price": price, "condition": condition, "change": "removed"}
+            )
+            self._db.execute("DELETE FROM watch_listings WHERE query = ? AND id = ?", (query, id_))
+        self._db.commit()
+        return changes
+
+
+async def check(query: SavedQuery, index: PriceIndex, enrich: bool = False) -> List[Dict]:
+    """Run one cycle of a saved query, product pages are only scraped for new or repriced listings."""
+    listings = []
+    failed_pages = []
+    # cheapest first, the search stops once `limit` listings are in
+    url = build_search_url(query.product, query.min_price, sort="price_asc")
+    async for page in iter_search(
+        url, query.min_price, query.max_pages, start_index=0, limit=query.limit, failed_pages=failed_pages
+    ):
+        listings.extend(page)
+    if failed_pages:
+        log.warning("{}: {} pages failed, not reporting removed listings this cycle", query, len(failed_pages))
+    prices = [listing.price for listing in listings if listing.price is not None]
+    changes = index.diff(query.key, listings, complete=not failed_pages, max_price=max(prices, default=0))
+    if enrich:
+        changed = {change["id"]: change for change in changes if change["change"] != "removed"}
+        urls = [change["url"] for change in changed.values()]
+        async for product in scrape_products(urls, query.min_price):
+            changed_listing = changed.get(item_id(product.url))
+            if changed_listing is not None:
+                changed_listing["product"] = product.to_dict()
+    log.info("{}: {} listings, {} changes", query, len(listings), len(changes))
+    return changes
+
+
+async def watch(
+    queries: List[SavedQuery], index: PriceIndex, enrich: bool = False, concurrency: int = 2
+) -> AsyncIterator[Tuple[SavedQuery, List[Dict]]]:
+    """Check every query on its own interval and yield (query, changes) after each cycle."""
+    semaphore = asyncio.Semaphore(concurrency)
+    updates = asyncio.Queue()
+
+    async def schedule(query: SavedQuery):
+        while True:
+            started = time.monotonic()
+            async with semaphore:
+                try:
+                    await updates.put((query, await check(query, index, enrich)))
+                except Exception as e:
+                    log.error(f"failed to check {query}: {e}")
+            await asyncio.sleep(max(0, query.interval - (time.monotonic() - started)))
+
+    tasks = [asyncio.create_task(schedule(query)) for query in queries]
+    try:
+        while True:
+            yield await updates.get()
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+def load_queries(path: Union[str, Path]) -> List[SavedQuery]:
+    with open(path) as f:
+        return [SavedQuery(**query) for query in json.load(f)]
+
+
+async def main(queries: List[SavedQuery]):
+    async for query, changes in watch(queries, PriceIndex()):
+        for change in changes:
+            print(json.dumps({"query": query.product, **change}))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+    if sys.argv[1].endswith(".json"):
+        saved_queries = load_queries(sys.argv[1])
+    else:
+        interval = int(sys.argv[3]) if len(sys.argv) > 3 else 3600
+        saved_queries = [SavedQuery(sys.argv[1], int(sys.argv[2]), interval)]
+    # every cycle has to see current prices, so don't serve search pages from the cache
+    ebay.CACHE = None
+    asyncio.run(main(saved_queries))